@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# Benchmark cloning and updating the topics cache from a local bare repository
+# with a long history: a full clone kept up to date with `git pull`, against
+# the --depth=1 clone (install.sh) and the --depth=1 --filter=blob:none sparse
+# clone (install.sh with QUICK_SPARSE) that `quick --update` fetches with
+# `fetch --depth=1` and a reset.
+#
+#   python bench/bench_clone.py [topics] [commits]
+#
+# Prints each clone's time and size on disk after cloning, and again after
+# fetching a few more commits.
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import quick
+
+SPARSE = ['git*', 'docker*']
+
+COMMANDS = ['git', 'docker', 'kubectl', 'npm', 'brew', 'ssh', 'tar', 'find', 'rsync', 'curl']
+
+# History
+# ---------------------------------------------------------
+# Written with one `git fast-import`, as committing topic by topic would take
+# far longer than the clones being measured.
+
+def sample_topic(rand, name):
+  lines = ['# %s' % name, '']
+  for i in xrange(rand.randint(5, 40)):
+    lines.append('    $ %s %s' % (name.split(':')[0], ' '.join('%x' % rand.getrandbits(24) for j in xrange(4))))
+  return '\n'.join(lines) + '\n'
+
+# write_history: append `commits` commits to master of `repo`, each changing a
+# few of `names`
+def write_history(repo, names, commits, rand, start=0):
+  proc = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=repo, stdin=subprocess.PIPE)
+  out = proc.stdin
+  for i in xrange(start, start + commits):
+    changed = names if i == 0 else rand.sample(names, 5)
+    message = 'Update %d' % i
+    out.write('commit refs/heads/master\n')
+    out.write('committer quick <quick@example.com> %d +0000\n' % (1300000000 + i * 60))
+    out.write('data %d\n%s\n' % (len(message), message))
+    if i == start and start:
+      out.write('from refs/heads/master^0\n')
+    for name in changed:
+      data = sample_topic(rand, name)
+      out.write('M 100644 inline %s.md\ndata %d\n%s\n' % (name, len(data), data))
+  out.close()
+  if proc.wait() != 0:
+    raise SystemExit('fast-import failed')
+
+# Measure
+# ---------------------------------------------------------
+
+def git(directory, *args):
+  quick.call(['git'] + list(args), cwd=directory)
+
+def disk_usage(directory):
+  total = 0
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      total += os.lstat(os.path.join(root, name)).st_blocks * 512
+  return total
+
+def clone_full(url, path):
+  git(None, 'clone', '-q', url, path)
+
+def clone_shallow(url, path):
+  git(None, 'clone', '-q', '--depth=1', url, path)
+
+def clone_sparse(url, path):
+  git(None, 'clone', '-q', '--depth=1', '--filter=blob:none', '--no-checkout', url, path)
+  git(path, 'sparse-checkout', 'set', '--no-cone', *['/%s.md' % pattern for pattern in SPARSE])
+  git(path, 'checkout', '-q')
+
+def timed(fn, *args):
+  start = time.time()
+  fn(*args)
+  return time.time() - start
+
+def main(argv):
+  count = int(argv[1]) if len(argv) > 1 else 2000
+  commits = int(argv[2]) if len(argv) > 2 else 3000
+  rand = random.Random(0)
+  directory = tempfile.mkdtemp(prefix='quick-bench-')
+  try:
+    origin = os.path.join(directory, 'wiki.git')
+    git(None, 'init', '-q', '--bare', origin)
+    git(origin, 'config', 'uploadpack.allowFilter', 'true')
+    names = ['%s%d' % (rand.choice(COMMANDS), i) for i in xrange(count)]
+    write_history(origin, names, commits, rand)
+    git(origin, 'gc', '-q')
+    url = 'file://' + origin  # A plain path would ignore --depth and --filter
+
+    print 'topics:  %d, commits: %d, origin %.1f MB' % (count, commits, disk_usage(origin) / 1e6)
+    clones = [
+      ('full', clone_full, lambda path: git(path, 'pull', '-q')),
+      ('shallow', clone_shallow, quick._sync_topics),
+      ('sparse', clone_sparse, quick._sync_topics),
+    ]
+    for name, clone, update in clones:
+      clone_seconds = timed(clone, url, os.path.join(directory, name))
+      clone_size = disk_usage(os.path.join(directory, name))
+      print '%-8s clone %6.2fs %7.1f MB' % (name + ':', clone_seconds, clone_size / 1e6)
+
+    write_history(origin, names, 20, rand, start=commits)
+    for name, clone, update in clones:
+      path = os.path.join(directory, name)
+      update_seconds = timed(update, path)
+      print '%-8s update %5.2fs %7.1f MB  %d topics checked out' % (name + ':', update_seconds,
+        disk_usage(path) / 1e6, len([f for f in os.listdir(path) if f.endswith('.md')]))
+  finally:
+    shutil.rmtree(directory)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# Benchmark colorize_markdown (batch) and colorize_lines (streaming) against
+# the original regex cascade.
+#
+#   python bench/bench_colorize.py [lines]
+#
+# Prints lines/sec for each and fails if any output differs.
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from quick import LineState, color, color_for_state, colorize_markdown, colorize_lines
+
+# Reference: parse_line as a cascade of regexes
+# ---------------------------------------------------------
+
+emptyLineExp = re.compile('^\s*$')
+blockquoteExp = re.compile('^\s{0,3}>')
+codeblockExp = re.compile('^(\t|    )')
+numberedExp = re.compile('^\s*\d+\.\s')
+bulletedExp = re.compile('^\s*[*-]\s')
+
+def _is_underline(line):
+  return (line[0:3] == '===' or line[0:3] == '---')
+
+def _is_seperator(line):
+  return line[0:3] == '---'
+
+def _line_state_is_list(state):
+  return state == LineState.BULLETED or state == LineState.NUMBERED
+
+def reference_parse_line(line, initial_state, last_line_was_empty, next_line):
+  line_state = LineState.PARAGRAPH
+  line_is_empty = False
+  if emptyLineExp.match(line):
+    line_is_empty = True
+    if _line_state_is_list(initial_state):
+      line_state = initial_state
+    else:
+      line_state = None
+  elif line[0] == '#':
+    line_state = LineState.TITLE
+  elif blockquoteExp.match(line):
+    if initial_state == LineState.BLOCKQUOTE or last_line_was_empty:
+      line_state = LineState.BLOCKQUOTE
+  elif codeblockExp.match(line):
+    if initial_state == LineState.CODEBLOCK or last_line_was_empty:
+      line_state = LineState.CODEBLOCK
+  elif _is_underline(next_line):
+    line_state = LineState.TITLE
+  elif initial_state == LineState.TITLE and _is_underline(line) and not last_line_was_empty:
+    line_state = LineState.TITLE
+    line_is_empty = True
+  elif numberedExp.match(line):
+    line_state = LineState.NUMBERED
+  elif bulletedExp.match(line):
+    line_state = LineState.BULLETED
+  elif _is_seperator(line):
+    line_state = LineState.SEPERATOR
+  if line_state == LineState.PARAGRAPH and (_line_state_is_list(initial_state) or initial_state == LineState.BLOCKQUOTE) and not last_line_was_empty:
+    line_state = initial_state
+  return line_state, line_is_empty
+
+def reference_colorize_markdown(markdown):
+  line = ''
+  last_line_was_empty = True
+  line_state = None
+  output = []
+  for next_line in markdown.split('\n'):
+    line_state, last_line_was_empty = reference_parse_line(line, line_state, last_line_was_empty, next_line)
+    output.append(color(line, color_for_state(line_state)) + '\n')
+    line = next_line
+  line_state, last_line_was_empty = reference_parse_line(line, line_state, last_line_was_empty, '')
+  output.append(color(line, color_for_state(line_state)) + '\n')
+  return ''.join(output)
+
+# Documents
+# ---------------------------------------------------------
+
+SAMPLE_LINES = [
+  '# Title', 'Subtitle', '--------', '=====', '---', '', '   ', '\t',
+  'Some paragraph text about git', 'continued paragraph',
+  '* bullet', '- dash bullet', '  * nested bullet', '*not bullet', '-',
+  '1. numbered', '  12. numbered', '1.5 not numbered', '3.',
+  '> quote', '   > quote', '    > code', '\t> quote',
+  '    git config --global user.name', '\tcode', '\x0cform feed',
+]
+
+def sample_document(count, seed=0):
+  rand = random.Random(seed)
+  return '\n'.join(rand.choice(SAMPLE_LINES) for i in xrange(count))
+
+def lines_per_second(fn, text, count, repeat=3):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    fn(text)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return count / best
+
+def streaming_colorize_markdown(markdown):
+  return ''.join(colorize_lines(markdown.split('\n')))
+
+def main(argv):
+  count = int(argv[1]) if len(argv) > 1 else 200000
+  text = sample_document(count)
+
+  expected = reference_colorize_markdown(text)
+  for fn in (colorize_markdown, streaming_colorize_markdown):
+    if fn(text) != expected:
+      sys.stderr.write('%s output differs from reference\n' % fn.__name__)
+      return 1
+
+  before = lines_per_second(reference_colorize_markdown, text, count)
+  print 'lines:     %d' % count
+  print 'reference: %12.0f lines/sec' % before
+  for name, fn in (('streaming', streaming_colorize_markdown), ('batch', colorize_markdown)):
+    after = lines_per_second(fn, text, count)
+    print '%-10s %12.0f lines/sec  (%.2fx)' % (name + ':', after, after / before)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
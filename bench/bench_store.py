@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# Benchmark the topic stores (QUICK_STORE files, pack, zpack and sqlite; git
+# needs a repository) on a generated cheat sheet corpus.
+#
+#   python bench/bench_store.py [topics]
+#
+# Prints each store's size on disk, the time to read and print one topic, to
+# list a topic's subtopics and to search, and fails if any store returns
+# different bytes.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import quick
+
+# Corpus
+# ---------------------------------------------------------
+# Topics repeat the same commands, flags and boilerplate, like the wiki.
+
+COMMANDS = ['git', 'docker', 'kubectl', 'npm', 'brew', 'ssh', 'tar', 'find', 'rsync', 'curl']
+WORDS = ['config', 'status', 'log', 'push', 'pull', 'run', 'build', 'install', 'list', 'remove',
+  '--global', '--force', '--all', '-v', '-r', 'origin', 'master', 'HEAD', 'file', 'dir']
+BOILERPLATE = [
+  'See also: quick --list', 'Edit this topic with `quick --edit`', '-----',
+  'Examples', '========', 'Options', '* Use `--help` for the full list of options',
+]
+
+def sample_topic(rand):
+  command = rand.choice(COMMANDS)
+  lines = ['# %s %s' % (command, rand.choice(WORDS)), '']
+  for i in xrange(rand.randint(5, 40)):
+    kind = rand.random()
+    if kind < 0.5:
+      lines.append('    $ %s %s' % (command, ' '.join(rand.choice(WORDS) for j in xrange(rand.randint(1, 4)))))
+    elif kind < 0.7:
+      lines.append(rand.choice(BOILERPLATE))
+    else:
+      lines.append(' '.join(rand.choice(WORDS + COMMANDS) for j in xrange(rand.randint(3, 12))))
+  return '\n'.join(lines) + '\n'
+
+def use_quick_dir(directory):
+  quick.QUICK_DIR = directory
+  quick.QUICK_CACHE_DIR = os.path.join(directory, 'cache')
+  quick.QUICK_RENDER_DIR = os.path.join(quick.QUICK_CACHE_DIR, '.rendered')
+  quick.QUICK_INDEX_DIR = os.path.join(quick.QUICK_CACHE_DIR, '.index')
+
+# Measure
+# ---------------------------------------------------------
+
+def disk_usage(paths):
+  return sum(os.stat(path).st_blocks * 512 for path in paths)
+
+def view_seconds(names, repeat=3):
+  out = open(os.devnull, 'wb')
+  sys.stdout = out
+  try:
+    best = None
+    for i in range(repeat):
+      start = time.time()
+      for name in names:
+        quick.print_color(quick.topic_store().data(name), quick.ColorMode.OFF)
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+  finally:
+    sys.stdout = sys.__stdout__
+    out.close()
+  return best / len(names)
+
+def call_seconds(fn, args, repeat=3):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    for arg in args:
+      fn(arg)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best / len(args)
+
+def main(argv):
+  count = int(argv[1]) if len(argv) > 1 else 5000
+  rand = random.Random(0)
+  directory = tempfile.mkdtemp(prefix='quick-bench-')
+  try:
+    use_quick_dir(directory)
+    os.makedirs(quick.QUICK_CACHE_DIR)
+    names = ['topic%d' % i for i in xrange(count // 10)]
+    names += ['topic%d:sub%d' % (i // 9, i) for i in xrange(count - len(names))]
+    for name in names:
+      with open(os.path.join(quick.QUICK_CACHE_DIR, name + '.md'), 'wb') as f:
+        f.write(sample_topic(rand))
+    sample = rand.sample(names, min(count, 1000))
+    expected = dict((name, quick.FileStore().data(name)[:]) for name in sample)
+
+    topics = ['topic%d' % i for i in xrange(0, count // 10, max(1, count // 1000))]
+    queries = ['%s %s' % (rand.choice(COMMANDS), rand.choice(WORDS).strip('-')) for i in xrange(50)]
+
+    print 'topics:  %d' % count
+    baseline = None
+    for store in ('files', 'pack', 'zpack', 'sqlite'):
+      quick.QUICK_STORE = store
+      start = time.time()
+      quick.build_topic_index()
+      if store == 'files':
+        quick.build_search_index()
+      built = time.time() - start
+      if any(quick.topic_store().data(name)[:] != expected[name] for name in sample):
+        sys.stderr.write('%s returned different topic bytes\n' % store)
+        return 1
+
+      if store == 'files':
+        paths = [quick.FileStore().path(name) for name in names]
+      elif store == 'sqlite':
+        paths = [quick.database_path()]
+      else:
+        paths = [quick.pack_path()]
+      seconds = view_seconds(sample)
+      baseline = baseline or seconds
+      print '%-7s %6.1f MB on disk  %6.1f us/view (%.2fx)  %5.1f us/list  %6.2f ms/search  built in %.2fs  %s' % (
+        store + ':', disk_usage(paths) / 1e6, seconds * 1e6, seconds / baseline,
+        call_seconds(quick.cache_list, topics) * 1e6, call_seconds(quick.search_topics, queries) * 1e3, built,
+        getattr(getattr(quick.topic_store(), 'codec', None), 'name', ''))
+  finally:
+    shutil.rmtree(directory)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -36,9 +36,26 @@ fi
 
 echo "Installing to $INSTALL_DIR"
 
-# Git clone source and cache
+# Git clone source and cache. Quick only needs the cache's latest commit, so
+# it is cloned with --depth=1 (and fetched that way by --update). With
+# QUICK_SPARSE, e.g. "git* docker*", only matching topics are checked out, and
+# --filter=blob:none leaves the other topics' contents on the server.
+# QUICK_STORE=git reads topics from a bare clone.
 git clone -q "$QUICK_URL" "$INSTALL_DIR"
-git clone -q "$CACHE_URL" "$INSTALL_DIR/cache"
+if [ "$QUICK_STORE" = "git" ]; then
+  git clone -q --bare --depth=1 "$CACHE_URL" "$INSTALL_DIR/cache"
+elif [ -n "$QUICK_SPARSE" ]; then
+  git clone -q --depth=1 --filter=blob:none --no-checkout "$CACHE_URL" "$INSTALL_DIR/cache"
+  set -f  # Patterns are for git, not the shell
+  PATTERNS=""
+  for PATTERN in $QUICK_SPARSE; do
+    PATTERNS="$PATTERNS /$PATTERN.md"
+  done
+  (cd "$INSTALL_DIR/cache" && git sparse-checkout set --no-cone $PATTERNS && git checkout -q)
+  set +f
+else
+  git clone -q --depth=1 "$CACHE_URL" "$INSTALL_DIR/cache"
+fi
 
 echo "Linking to $PREFIX/quick"
 
@@ -48,6 +65,7 @@ cat > "$PREFIX/quick" <<EOF
 
 # Environment variable to QUICK_DIR
 export QUICK_DIR=\${QUICK_DIR:-"$INSTALL_DIR"}
+export QUICK_STORE=\${QUICK_STORE:-"${QUICK_STORE:-files}"}
 
 # Execute quick
 "\$QUICK_DIR/bin/quick" "\$@"
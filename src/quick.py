@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 
-import argparse
+# Modules only some commands need (argparse, subprocess, glob, tempfile,
+# multiprocessing, webbrowser) are imported where they are used, so viewing a
+# topic stays fast to start.
 import sys
 import os
-import subprocess
-import glob
-import webbrowser
+import io
+import heapq
+import math
+import struct
+import itertools
+import shutil
 import re
-from pprint import pprint
 
 # Constants
 # =========================================================
@@ -16,6 +20,21 @@ VERSION = "v0.0.3\n"
 
 QUICK_DIR = os.environ.get('QUICK_DIR') or os.path.join(os.environ.get('HOME'), ".quick")
 QUICK_CACHE_DIR = os.path.join(QUICK_DIR, 'cache')
+QUICK_RENDER_DIR = os.path.join(QUICK_CACHE_DIR, '.rendered')
+QUICK_INDEX_DIR = os.path.join(QUICK_CACHE_DIR, '.index')
+QUICK_STORE = os.environ.get('QUICK_STORE') or 'files'
+
+# env_hours: environment variable `name` as a number of hours, `default` when
+# unset or not a number, and 0 (never) when not positive
+def env_hours(name, default):
+  try:
+    hours = float(os.environ.get(name) or default)
+  except ValueError:
+    return default
+  return hours if hours > 0 else 0
+
+QUICK_AUTO_UPDATE = env_hours('QUICK_AUTO_UPDATE', 24)  # 0 for never
+QUICK_SOURCES = [os.path.expanduser(path) for path in (os.environ.get('QUICK_SOURCES') or '').split(os.pathsep) if path]
 
 SHORT_USAGE = """
   quick [options] topic[:subtopic]
@@ -25,6 +44,8 @@ SHORT_USAGE = """
     -e, --edit                    Edit topic or subtopic
     -w, --web                     Open quick file in website
     -u, --update                  Update quick and its topics cache
+    -s, --search                  Search the contents of all topics
+    -g, --grep                    Print topic lines matching a regex
 
 """
 
@@ -33,6 +54,8 @@ LONG_USAGE = """
 
     quick [options] topic
     quick [options] topic:subtopic
+    quick [options] --search terms...
+    quick [options] --grep pattern [topic]
 
   Options:
 
@@ -41,24 +64,41 @@ LONG_USAGE = """
     -e, --edit                    Edit topic or subtopic
     -w, --web                     Open quick file in website
     -u, --update                  Update quick and its topics cache
+    -s, --search                  Search the contents of all topics
+    -g, --grep                    Print topic lines matching a regex
     --color                       Force color printing
     --nocolor                     Force no color printing
+    --no-render-cache             Colorize without the rendered topic cache
+    --no-prerender                Skip rendering changed topics on update
+    -j, --jobs N                  Worker processes for update and grep
+    --completions SHELL           Output a bash, zsh or fish completion script
+    --store STORE                 Read topics from files, pack, zpack, git
+                                  or sqlite (default: QUICK_STORE or files)
     --version                     Output the version number
 
   Environment: (optional)
 
     QUICK_OPTIONS                 Options prepended to all commands
+    QUICK_STORE                   Default for --store
+    QUICK_AUTO_UPDATE             Hours before a view updates the topics in
+                                  the background (default: 24, 0 for never)
+    QUICK_SOURCES                 Topic directories or git checkouts read
+                                  before the quick wiki, ':' separated;
+                                  earlier ones win a topic name
 
   Examples:
 
     quick git                     View the `git` topic
     quick git:config              View `git:config` subtopic
     quick git:                    List `git` subtopics
+    quick ?rebase                 Search topics for `rebase`
 
     quick --edit git              Edit or create `git` topic
     quick --edit git:config       Edit or create `git:config` subtopic
     quick --list git              List `git` subtopics
     quick --web git               Open `git` topic in a website
+    quick --search merge conflict Search topics for `merge` and `conflict`
+    quick --grep 'push -f' git    Lines matching `push -f` in `git` topics
     quick --update                Update quick
 
 """
@@ -77,49 +117,154 @@ def enum(*sequential, **named):
 Exit = enum(SUCCESS=0, ERROR=1, ARGUMENT_ERROR=2)
 
 # ColorMode
-ColorMode = enum(AUTO=1, ON=2, OFF=2)
+ColorMode = enum(AUTO=1, ON=2, OFF=3)
 
 # Helpers
 # =========================================================
 
-class working_dir:
-  def __init__(self, directory):
-    self.scoped_dir = directory
-  def __enter__(self):
-    self.old_dir = os.getcwd()
-    os.chdir(self.scoped_dir)
-  def __exit__(self, type, value, traceback):
-    os.chdir(self.old_dir)
+GIT_TIMEOUT = 300    # Seconds before a git command is killed
+GIT_JOBS = 4         # Git commands run_parallel runs at once
+STREAM_CHUNK = 1 << 16
+
+# _popen: start `args` in `cwd` with stdout piped. Descriptors are closed in
+# the child so a process started by one thread can't hold another thread's
+# pipes open (and its reader blocked).
+def _popen(args, cwd=None, stderr=None):
+  import subprocess
+  return subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr or subprocess.PIPE,
+    cwd=cwd, close_fds=True)
+
+# _kill_after: a started timer that kills `proc` after `timeout` seconds
+# (None for no timer). timer.fired is set if it did.
+def _kill_after(proc, timeout):
+  if timeout is None:
+    return None
+  import threading
+  def kill():
+    timer.fired = True
+    try:
+      proc.kill()
+    except OSError:
+      pass  # Already exited
+  timer = threading.Timer(timeout, kill)
+  timer.fired = False
+  timer.daemon = True
+  timer.start()
+  return timer
+
+# _stopped: raise if the exited `proc` was killed by `timer` or failed
+def _stopped(proc, timer, args, err):
+  if timer:
+    timer.cancel()
+    if timer.fired:
+      raise BaseException('%s timed out after %ss' % (' '.join(args), timer.interval))
+  if proc.returncode != Exit.SUCCESS:
+    raise BaseException(err)
 
-# call: execute command as subprocess with list of arguments
+# call: execute command as subprocess with list of arguments, in `cwd` if
+# given, killing it after `timeout` seconds
 # returns triplet: code, out, err
-def call(args):
-  proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def call(args, cwd=None, timeout=None):
+  proc = _popen(args, cwd)
+  timer = _kill_after(proc, timeout)
   out, err = proc.communicate()
-  code = proc.returncode
-  if code != Exit.SUCCESS:
-    raise BaseException(err)
-  return code, out, err
-
-# Execute git command
-def git(directory, args):
-  with working_dir(directory):
-    return call(['git'] + args)
+  _stopped(proc, timer, args, err)
+  return proc.returncode, out, err
+
+# call_lines: like call, but yields stdout as it is read, split on `sep`
+# (without it)
+def call_lines(args, cwd=None, timeout=None, sep='\n'):
+  import tempfile
+  with tempfile.TemporaryFile() as err:  # A pipe could fill and block
+    proc = _popen(args, cwd, stderr=err)
+    timer = _kill_after(proc, timeout)
+    done = False
+    try:
+      rest = ''
+      for chunk in iter(lambda: os.read(proc.stdout.fileno(), STREAM_CHUNK), ''):
+        lines = (rest + chunk).split(sep)
+        rest = lines.pop()
+        for line in lines:
+          yield line
+      done = True
+    finally:
+      proc.stdout.close()
+      if not done and proc.poll() is None:
+        proc.kill()  # The caller stopped early
+      proc.wait()
+      if timer:
+        timer.cancel()
+    if rest:
+      yield rest
+    err.seek(0)
+    _stopped(proc, timer, args, err.read())
+
+# Execute git command in `directory`. Doesn't change the working directory,
+# so threads can run git at once.
+def git(directory, args, timeout=GIT_TIMEOUT):
+  return call(['git', '-C', directory] + args, timeout=timeout)
+
+# git_lines: git's output line by line (or split on `sep`), as it is read
+def git_lines(directory, args, timeout=GIT_TIMEOUT, sep='\n'):
+  return call_lines(['git', '-C', directory] + args, timeout=timeout, sep=sep)
+
+# write_atomic: replace `path` with `data` via a temp file and rename
+def write_atomic(path, data):
+  import tempfile
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.rename(tmp_path, path)
+  except:
+    os.remove(tmp_path)
+    raise
 
+# Task: report 'name... OK' or 'name... ERROR (reason)' around a step. A
+# concurrent task writes its whole line when it finishes, so tasks running
+# in parallel threads don't interleave.
 class Task:
-  def __init__(self, task_name, quiet=True):
+  def __init__(self, task_name, quiet=True, concurrent=False):
     self.task_name = task_name
     self.quiet = quiet
+    self.concurrent = concurrent
   def __enter__(self):
-    if not self.quiet:
+    if not self.quiet and not self.concurrent:
       sys.stdout.write(self.task_name + '... ')
       sys.stdout.flush()
   def __exit__(self, type, value, traceback):
     if not self.quiet:
-      if type == None:
-        print 'OK'
-      else:
-        print 'ERROR (%s)' % value
+      status = 'OK' if type == None else 'ERROR (%s)' % str(value).strip()
+      if self.concurrent:
+        status = self.task_name + '... ' + status
+      sys.stdout.write(status + '\n')
+      sys.stdout.flush()
+
+# run_parallel: call the functions in `fns` from at most `jobs` threads
+#   => [(result, None) or (None, exception), ...] in the order of `fns`
+def run_parallel(fns, jobs=GIT_JOBS):
+  import threading
+  results = [(None, None)] * len(fns)
+  todo = iter(list(enumerate(fns)))
+  lock = threading.Lock()
+  def work():
+    while True:
+      with lock:
+        i, fn = next(todo, (None, None))
+      if fn is None:
+        return
+      try:
+        results[i] = (fn(), None)
+      except BaseException as e:  # call() raises BaseException
+        results[i] = (None, e)
+  threads = [threading.Thread(target=work) for i in xrange(min(jobs or 1, len(fns)))]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for thread in threads:
+    while thread.is_alive():
+      thread.join(0.1)  # A timeout keeps Ctrl-C working
+  return results
 
 # parse_topic
 # ---------------------------------------------------------
@@ -127,12 +272,20 @@ class Task:
 #   => {'list'=False, 'edit'=False, 'topic'='git', 'subtopic'='config'}
 # parse_topic("git:")
 #   => {'list'=True, 'edit'=False, 'topic'='git', 'subtopic'=None}
+# parse_topic("?rebase")
+#   => {'search'=True, 'topic'='rebase', 'subtopic'=None, ...}
 
 def parse_topic(topic):
-  out = {'list':False, 'edit':False, 'web':False, 'topic':None, 'subtopic':None}
+  out = {'list':False, 'edit':False, 'web':False, 'search':False, 'topic':None, 'subtopic':None}
   if topic == "" or topic == None:
     return out
 
+  # Start with '?' searches, the rest is the query
+  if topic[0] == '?':
+    out['search'] = True
+    out['topic'] = topic[1:] or None
+    return out
+
   # End in ':' lists
   if topic[-1] == ':':
     out['list'] = True
@@ -158,7 +311,7 @@ def parse_topic(topic):
 def die(message, error_code = Exit.ARGUMENT_ERROR):
   sys.stderr.write('\n  ERROR: %s\n' % message)
   sys.stdout.write(SHORT_USAGE)
-  exit(error_code)
+  sys.exit(error_code)
 
 # Example: 'git:config'
 def cache_name(topic, subtopic=None):
@@ -177,9 +330,26 @@ def cache_path(topic, subtopic=None):
   return os.path.join(QUICK_CACHE_DIR, fname)
 
 def cache_file_exists(topic, subtopic=None):
+  index = topic_index()
+  if index:
+    return index.exists(cache_name(topic, subtopic))
   return os.path.exists(cache_path(topic, subtopic))
 
 def cache_list(topic, subtopic=None, deep=True):
+  if QUICK_STORE == 'sqlite':
+    store = sqlite_store()
+    if store:
+      return store.names(topic, deep)
+
+  index = topic_index()
+  if index:
+    if topic:
+      return index.subtopics(topic)
+    if deep:
+      return index.names()
+    return index.topics_with_prefix('')
+
+  import glob
   if topic:
     glob_name = cache_file(topic, '*')
   else:
@@ -193,64 +363,334 @@ def cache_list(topic, subtopic=None, deep=True):
 
   # Remove extension and path
   ext = '.md'
-  return [os.path.basename(f)[0:-len(ext)] for f in files]
+  return sorted(os.path.basename(f)[0:-len(ext)] for f in files)
+
+# git_head: commit a checkout is at
+def git_head(directory):
+  code, out, err = git(directory, ['rev-parse', 'HEAD'])
+  return out.strip()
+
+# git_dir: the repository directory of a checkout or bare clone
+def git_dir(directory):
+  dot_git = os.path.join(directory, '.git')
+  if os.path.isdir(dot_git):
+    return dot_git
+  return directory
+
+def is_bare(directory):
+  return git_dir(directory) == directory and os.path.exists(os.path.join(directory, 'HEAD'))
+
+# is_shallow: True for a clone with truncated history (clone --depth)
+def is_shallow(directory):
+  return os.path.exists(os.path.join(git_dir(directory), 'shallow'))
+
+# read_git_head: git_head without starting git, by reading HEAD and the ref
+# it points at (loose or packed)
+def read_git_head(directory):
+  repo = git_dir(directory)
+  with open(os.path.join(repo, 'HEAD')) as f:
+    head = f.read().strip()
+  if not head.startswith('ref: '):
+    return head
+  ref = head[len('ref: '):]
+  try:
+    with open(os.path.join(repo, ref)) as f:
+      return f.read().strip()
+  except IOError:
+    with open(os.path.join(repo, 'packed-refs')) as f:
+      for line in f:
+        if line.rstrip('\n').endswith(' ' + ref):
+          return line.split(' ', 1)[0]
+  raise IOError('%s not found in %s' % (ref, repo))
+
+# git_tree_entries: (name, sha, size) of the topics in HEAD's tree
+def git_tree_entries(directory):
+  ext = '.md'
+  entries = []
+  for item in git_lines(directory, ['ls-tree', '-z', '-l', 'HEAD'], sep='\0'):
+    if not item:
+      continue
+    info, path = item.split('\t', 1)
+    mode, kind, sha, size = info.split()
+    if kind == 'blob' and path.endswith(ext) and not path.startswith('.'):
+      entries.append((path[0:-len(ext)], sha, int(size)))
+  return entries
+
+# git_changes: files changed between two commits. Renames show as a delete and
+# an add: finding them compares contents, which a partial clone would have to
+# download first.
+#   => [('M', 'git.md', None), ('D', 'old.md', None), ('A', 'new.md', None), ...]
+def git_changes(directory, old, new):
+  code, out, err = git(directory, ['diff', '--name-status', '--no-renames', '-z', old, new])
+  fields = out.split('\0')
+  changes = []
+  i = 0
+  while i < len(fields) and fields[i]:
+    status = fields[i][0]
+    if status in 'RC':
+      changes.append((status, fields[i + 1], fields[i + 2]))
+      i += 3
+    else:
+      changes.append((status, fields[i + 1], None))
+      i += 2
+  return changes
+
+# _pull: bring a checkout or bare clone up to date with its origin
+def _pull(directory):
+  if is_bare(directory):
+    git(directory, ['fetch', '-q', 'origin', '+refs/heads/*:refs/heads/*'])
+  else:
+    git(directory, ['pull', '-q'])
 
-def _update_quick(quiet=True):
-  with Task('Updating quick', quiet):
+def _update_quick(quiet=True, concurrent=False):
+  with Task('Updating quick', quiet, concurrent):
     code, out, err = git(QUICK_DIR, ['pull', '-q'])
 
-def _update_topics(quiet=True):
-  with Task('Updating topics', quiet):
-    code, out, err = git(QUICK_CACHE_DIR, ['pull', '-q'])
-
-def quick_update(quiet=True):
+# _sync_topics: move the topics cache to its origin's branch. The cache is a
+# mirror with nothing of its own to merge, so a checkout is reset rather than
+# pulled. A shallow clone (install.sh clones with --depth=1) fetches just the
+# new tip, and a partial one downloads only the blobs its sparse checkout uses.
+def _sync_topics(directory):
+  depth = ['--depth=1'] if is_shallow(directory) else []
+  if is_bare(directory):
+    git(directory, ['fetch', '-q'] + depth + ['origin', '+refs/heads/*:refs/heads/*'])
+  else:
+    git(directory, ['fetch', '-q'] + depth + ['origin'])
+    git(directory, ['reset', '-q', '--hard', '@{upstream}'])
+
+# _update_topics: sync the topics cache, returning HEAD before and after
+def _update_topics(quiet=True, concurrent=False):
+  with Task('Updating topics', quiet, concurrent):
+    old_head = git_head(QUICK_CACHE_DIR)
+    _sync_topics(QUICK_CACHE_DIR)
+    new_head = git_head(QUICK_CACHE_DIR)
+  return old_head, new_head
+
+# _source_updates: a function pulling each git source in QUICK_SOURCES, for
+# run_parallel (plain directories have nothing to pull)
+def _source_updates(quiet=True):
+  def update(directory):
+    with Task('Updating %s' % directory, quiet, concurrent=True):
+      _pull(directory)
+  return [lambda directory=directory: update(directory)
+    for directory in QUICK_SOURCES if os.path.exists(os.path.join(git_dir(directory), 'HEAD'))]
+
+# _update_cache: pull the topics cache and every git source at once, then
+# refresh the indexes. `fns` are more updates to run alongside. Holds the
+# update lock throughout, waiting for it unless `background`: a background
+# update gives way to any other, and skips an update that is no longer due.
+def _update_cache(quiet=True, jobs=None, prerender=True, fns=[], background=False):
+  lock = update_lock(wait=not background)
+  if background and (lock is None or not _update_due()):
+    release_lock(lock)
+    return
   try:
-    _update_quick(quiet)
-    _update_topics(quiet)
-  except:
-    pass  # Absorb error
+    results = run_parallel(fns + [lambda: _update_topics(quiet, concurrent=True)] + _source_updates(quiet))
+    heads, error = results[len(fns)]
+    if not error:
+      mark_updated()
+    # Other sources may have changed even when the cache could not be pulled
+    if not error or QUICK_SOURCES:
+      try:
+        _topics_updated(heads[0] if heads else None, heads[1] if heads else None, quiet, jobs, prerender)
+      except:
+        pass  # Absorb error
+  finally:
+    release_lock(lock)
+
+# _topics_updated: refresh everything derived from the topics cache
+def _topics_updated(old_head, new_head, quiet=True, jobs=None, prerender=True):
+  changes = []
+  if old_head != new_head:
+    changes = git_changes(QUICK_CACHE_DIR, old_head, new_head)
+  with Task('Indexing topics', quiet):
+    if QUICK_SOURCES:
+      _sourcesChecked.clear()
+      checked_sources_index()  # Picks up topics edited in place
+    if changes or not load_topic_index() or not os.path.exists(names_path()) or not topic_store_current():
+      build_topic_index()
+    if QUICK_STORE != 'sqlite':  # Searched with FTS5
+      update_search_index(changes, old_head, new_head)
+  if prerender and changes:
+    with Task('Rendering topics', quiet):
+      prerender_changes(changes, jobs)
+
+# quick_update: pull quick, the topics cache and the git sources in
+# parallel, then refresh what the topics changed. Any pull can fail without
+# stopping the others.
+def quick_update(quiet=True, jobs=None, prerender=True):
+  _update_cache(quiet, jobs, prerender, fns=[lambda: _update_quick(quiet, concurrent=True)])
+
+def cache_update(quiet=True, jobs=None, prerender=True):
+  _update_cache(quiet, jobs, prerender)
+
+# Auto Update
+# ---------------------------------------------------------
+# Stale while revalidate: once the last successful update is more than
+# QUICK_AUTO_UPDATE hours old, `quick <topic>` still prints from the cache as
+# it is, then main() leaves a detached process to update it (command_view
+# itself never forks, so it can be called in-process). The view costs two
+# stats and a fork, and never waits on the network.
+#
+# .index/updated is touched by every successful update. Every update holds
+# an flock on .index/update.lock, so a foreground --update waits for a
+# background one rather than run git in the same checkout, and views don't
+# start one while another runs. It is touched when an update starts, so one
+# that fails (say offline) is retried every AUTO_UPDATE_RETRY seconds rather
+# than on every view.
+
+AUTO_UPDATE_RETRY = 15 * 60
+
+def updated_path():
+  return os.path.join(QUICK_INDEX_DIR, 'updated')
+
+def update_lock_path():
+  return os.path.join(QUICK_INDEX_DIR, 'update.lock')
+
+def _touch(path):
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'a'):
+    os.utime(path, None)
+
+def mark_updated():
+  try:
+    _touch(updated_path())
+  except (IOError, OSError):
+    pass
 
-def cache_update(quiet=True):
+# _seconds_since: seconds since `path` was modified (None when missing)
+def _seconds_since(path):
+  import time
   try:
-    _update_topics(quiet)
-  except:
-    pass  # Absorb error
+    return time.time() - os.stat(path).st_mtime
+  except OSError:
+    return None
+
+def _update_due():
+  age = _seconds_since(updated_path())
+  return age is None or age > QUICK_AUTO_UPDATE * 3600
+
+# cache_stale: True when a view should start a background update
+def cache_stale():
+  if not QUICK_AUTO_UPDATE or not _update_due():
+    return False
+  attempt = _seconds_since(update_lock_path())
+  if attempt is not None and attempt < AUTO_UPDATE_RETRY:
+    return False
+  return os.path.exists(os.path.join(git_dir(QUICK_CACHE_DIR), 'HEAD'))
+
+# revalidate_cache: start a background update when the cache is stale. The
+# update runs in a grandchild in its own session with stdio on /dev/null, so
+# it outlives this process and doesn't hold a pipe (`quick git | less`) open.
+def revalidate_cache():
+  if not cache_stale():
+    return
+  sys.stdout.flush()
+  sys.stderr.flush()
+  try:
+    pid = os.fork()
+  except OSError:
+    return
+  if pid:
+    os.waitpid(pid, 0)  # Exits as soon as it has forked
+    return
+  try:
+    os.setsid()
+    if os.fork() == 0:
+      devnull = os.open(os.devnull, os.O_RDWR)
+      for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+      background_update()
+  finally:
+    os._exit(0)
+
+# update_lock: a descriptor holding the flock on .index/update.lock, or None
+# when `wait` is False and another update holds it. Without a cache to put
+# it in there is nothing to lock, and this is also None.
+def update_lock(wait=True):
+  import fcntl
+  if not os.path.isdir(QUICK_CACHE_DIR):
+    return None
+  try:
+    _touch(update_lock_path())
+    fd = os.open(update_lock_path(), os.O_RDWR)
+  except (IOError, OSError):
+    return None
+  # Not inherited by git: a cat-file kept running would hold the lock
+  fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+  except IOError:
+    os.close(fd)
+    return None
+  return fd
 
+def release_lock(fd):
+  if fd is not None:
+    os.close(fd)
 
-LineState = enum('PARAGRAPH', 'TITLE', 'BULLETED', 'NUMBERED', 'BLOCKQUOTE', 'CODEBLOCK', 'SEPERATOR')
-emptyLineExp = re.compile('^\s*$')
-blockquoteExp = re.compile('^\s{0,3}>')
-codeblockExp = re.compile('^(\t|    )')
-numberedExp = re.compile('^\s*\d+\.\s')
-bulletedExp = re.compile('^\s*[*-]\s')
+# background_update: cache_update unless another process holds the update
+# lock or has just updated
+def background_update():
+  _update_cache(background=True)
 
-def _is_underline(line):
-  return (line[0:3] == '===' or line[0:3] == '---')
 
-def _is_seperator(line):
-  return line[0:3] == '---'
+LineState = enum('PARAGRAPH', 'TITLE', 'BULLETED', 'NUMBERED', 'BLOCKQUOTE', 'CODEBLOCK', 'SEPERATOR')
+LineKind = enum('EMPTY', 'HEADER', 'QUOTE', 'INDENTED', 'DOUBLE_RULE', 'RULE', 'NUMBERED', 'BULLETED', 'TEXT')
+numberedExp = re.compile(r'\d+\.\s')
+
+# Whitespace as matched by `\s`
+_SPACE = ' \t\n\r\x0b\x0c'
+_DIGITS = '0123456789'
+_UNDERLINES = (LineKind.DOUBLE_RULE, LineKind.RULE)
+
+# classify_line: decide the kind of a line from the line alone, dispatching on
+# its first non-space character. Only candidate numbered lines hit a regex.
+def classify_line(line):
+  if not line:
+    return LineKind.EMPTY
+
+  c = line[0]
+  if c == '#':
+    return LineKind.HEADER
+
+  body = line
+  if c in _SPACE:
+    body = line.lstrip(_SPACE)
+    if not body:
+      return LineKind.EMPTY
+    if body[0] == '>' and len(line) - len(body) <= 3:
+      return LineKind.QUOTE
+    if c == '\t' or line[0:4] == '    ':
+      return LineKind.INDENTED
+  elif c == '>':
+    return LineKind.QUOTE
+  elif c == '=' and line[0:3] == '===':
+    return LineKind.DOUBLE_RULE
+  elif c == '-' and line[0:3] == '---':
+    return LineKind.RULE
+
+  c = body[0]
+  if c in _DIGITS:
+    if numberedExp.match(body):
+      return LineKind.NUMBERED
+  elif c == '*' or c == '-':
+    if len(body) > 1 and body[1] in _SPACE:
+      return LineKind.BULLETED
+  return LineKind.TEXT
 
 def _line_state_is_list(state):
   return state == LineState.BULLETED or state == LineState.NUMBERED
 
-def color_for_state(state):
-  colors_map = {
-      LineState.PARAGRAPH:  'normal',
-      LineState.TITLE:      'blue',
-      LineState.NUMBERED:   'green',
-      LineState.BULLETED:   'yellow',
-      LineState.BLOCKQUOTE: 'purple',
-      LineState.CODEBLOCK:  'cyan',
-      LineState.SEPERATOR:  'red'
-  }
-  return colors_map.get(state) or 'normal'
-
-def parse_line(line, initial_state, last_line_was_empty, next_line):
+# _transition: markdown rules for one line given its kind, whether the next
+# line underlines it, and the state carried from the previous line.
+def _transition(kind, next_is_underline, initial_state, last_line_was_empty):
   line_state = LineState.PARAGRAPH
   line_is_empty = False
 
   # \n
-  if emptyLineExp.match(line):
+  if kind == LineKind.EMPTY:
     line_is_empty = True
     if _line_state_is_list(initial_state):
       line_state = initial_state
@@ -258,34 +698,34 @@ def parse_line(line, initial_state, last_line_was_empty, next_line):
       line_state = None
 
   # ### Title
-  elif line[0] == '#':
+  elif kind == LineKind.HEADER:
     line_state = LineState.TITLE
 
   # > Blockquote
-  elif blockquoteExp.match(line):
+  elif kind == LineKind.QUOTE:
     if initial_state == LineState.BLOCKQUOTE or last_line_was_empty:
       line_state = LineState.BLOCKQUOTE
 
   #     Code block
-  elif codeblockExp.match(line):
+  elif kind == LineKind.INDENTED:
     if initial_state == LineState.CODEBLOCK or last_line_was_empty:
       line_state = LineState.CODEBLOCK
 
   #   Title followed by --------
-  elif _is_underline(next_line):
+  elif next_is_underline:
     line_state = LineState.TITLE
 
-  elif initial_state == LineState.TITLE and _is_underline(line) and not last_line_was_empty:
+  elif initial_state == LineState.TITLE and kind in _UNDERLINES and not last_line_was_empty:
     line_state = LineState.TITLE
     line_is_empty = True # Don't continue the TITLE after the underline
 
-  elif numberedExp.match(line):
+  elif kind == LineKind.NUMBERED:
     line_state = LineState.NUMBERED
 
-  elif bulletedExp.match(line):
+  elif kind == LineKind.BULLETED:
     line_state = LineState.BULLETED
 
-  elif _is_seperator(line):
+  elif kind == LineKind.RULE:
     line_state = LineState.SEPERATOR
 
   if line_state == LineState.PARAGRAPH and (_line_state_is_list(initial_state) or initial_state == LineState.BLOCKQUOTE) and not last_line_was_empty:
@@ -293,36 +733,255 @@ def parse_line(line, initial_state, last_line_was_empty, next_line):
 
   return line_state, line_is_empty
 
+# LINE_TRANSITIONS[kind, next_is_underline, initial_state, last_line_was_empty]
+#   => (line_state, line_is_empty)
+_ALL_STATES = [None] + sorted(LineState.reverse_mapping)
+LINE_TRANSITIONS = dict(
+  ((kind, underline, state, empty), _transition(kind, underline, state, empty))
+  for kind in LineKind.reverse_mapping
+  for underline in (False, True)
+  for state in _ALL_STATES
+  for empty in (False, True))
+
+STATE_COLORS = {
+  None:                 'normal',
+  LineState.PARAGRAPH:  'normal',
+  LineState.TITLE:      'blue',
+  LineState.NUMBERED:   'green',
+  LineState.BULLETED:   'yellow',
+  LineState.BLOCKQUOTE: 'purple',
+  LineState.CODEBLOCK:  'cyan',
+  LineState.SEPERATOR:  'red'
+}
+
+def color_for_state(state):
+  return STATE_COLORS.get(state) or 'normal'
+
+def parse_line(line, initial_state, last_line_was_empty, next_line):
+  next_is_underline = next_line[0:3] == '===' or next_line[0:3] == '---'
+  return LINE_TRANSITIONS[classify_line(line), next_is_underline, initial_state, last_line_was_empty]
+
+lineExp = re.compile(r'^.*$', re.MULTILINE)
+lineEndExp = re.compile(r'\n')
+
+# split_lines: iterate a topic's bytes (str, mmap or buffer) as
+# `str.split('\n')` would, copying one line at a time
+def split_lines(data):
+  for m in lineExp.finditer(data):
+    yield m.group()
+
+# colorize_pairs: generator of colored lines ('\n' terminated) from
+# `(line, kind)` pairs. Each line's LineState depends on the state before it
+# and on whether the next line underlines it, so one pair is held back as the
+# lookahead.
+def colorize_pairs(pairs):
+  transitions = LINE_TRANSITIONS
+  starts = STATE_COLOR_STARTS
+  end = COLOR_END + '\n'
+  underlines = _UNDERLINES
 
-def colorize_markdown(markdown):
-  previous_line = None
   line = ''
+  kind = LineKind.EMPTY
   last_line_was_empty = True
   line_state = None
 
-  output = ''
-  for next_line in markdown.split('\n'):
-    line_state, last_line_was_empty = parse_line(line, line_state, last_line_was_empty, next_line)
-    output += color(line, color_for_state(line_state)) + '\n'
+  for next_line, next_kind in pairs:
+    line_state, last_line_was_empty = transitions[kind, next_kind in underlines, line_state, last_line_was_empty]
+    yield starts[line_state] + line + end
 
     # Prepare for next iteration
-    previous_line = line
     line = next_line
+    kind = next_kind
 
   # Parse the last line
-  next_line = ''
-  line_state, last_line_was_empty = parse_line(line, line_state, last_line_was_empty, next_line)
-  output += color(line, color_for_state(line_state)) + '\n'
+  line_state, last_line_was_empty = transitions[kind, False, line_state, last_line_was_empty]
+  yield starts[line_state] + line + end
+
+# colorize_lines: generator of colored lines ('\n' terminated). Only the
+# current line and its lookahead are held, so memory stays flat. Each line is
+# classified once, as it is read.
+def colorize_lines(lines):
+  lines, ahead = itertools.tee(lines)
+  return colorize_pairs(itertools.izip(lines, itertools.imap(classify_line, ahead)))
+
+# lineKindExp: one alternative per LineKind, in classify_line's priority
+# order, then the rest of the line. With MULTILINE it matches exactly once per
+# line, so `m.lastindex - 1` is that line's kind.
+lineKindExp = re.compile(r'''^(?:
+    ([^\S\n]*$)                   # EMPTY
+  | (\#)                          # HEADER
+  | ([^\S\n]{0,3}>)               # QUOTE
+  | (\t|\ {4})                    # INDENTED
+  | (===)                         # DOUBLE_RULE
+  | (---)                         # RULE
+  | ([^\S\n]*\d+\.[^\S\n])        # NUMBERED
+  | ([^\S\n]*[*-][^\S\n])         # BULLETED
+  | ()                            # TEXT
+  )[^\n]*''', re.MULTILINE | re.VERBOSE)
+
+# classify_document: kinds of every line of `markdown` (split on '\n') in a
+# single regex scan, without a Python call per line
+def classify_document(markdown):
+  return [m.lastindex - 1 for m in lineKindExp.finditer(markdown)]
+
+# colorize_markdown: batch version of colorize_lines for a whole document.
+# Lines are classified up front in one regex scan.
+def colorize_markdown(markdown):
+  return ''.join(colorize_pairs(itertools.izip(markdown.split('\n'), classify_document(markdown))))
 
-  return output
+# Buffered binary writer over stdout (flushes whatever sys.stdout holds first)
+def buffered_stdout(size=1 << 16):
+  sys.stdout.flush()
+  try:
+    fd = sys.stdout.fileno()
+  except (AttributeError, IOError, ValueError):
+    return sys.stdout  # Not backed by a file (captured or embedded)
+  return io.open(fd, 'wb', size, closefd=False)
 
-def print_color(markdown, color_mode):
-  # Detect color mode
+def detect_color_mode(color_mode):
   if color_mode == ColorMode.AUTO and sys.stdout.isatty():
-    color_mode = ColorMode.ON
-  if color_mode == ColorMode.ON:
-    markdown = colorize_markdown(markdown)
-  print(markdown)
+    return ColorMode.ON
+  return color_mode
+
+# print_color: write topic `data` (from a TopicStore) to stdout, colorizing
+# line by line. With a `rendered_path` and render `key` the colored output is
+# also saved to the rendered cache.
+def print_color(data, color_mode, rendered_path=None, key=None):
+  color_mode = detect_color_mode(color_mode)
+
+  out = buffered_stdout()
+  try:
+    if color_mode != ColorMode.ON:
+      out.write(data)
+      out.write('\n')
+    elif rendered_path and key:
+      write_rendered(rendered_path, key, colorize_lines(split_lines(data)), out)
+    else:
+      out.writelines(colorize_lines(split_lines(data)))
+      out.write('\n')
+  finally:
+    out.flush()
+
+# Rendered Cache
+# ---------------------------------------------------------
+# Colored output of a topic is kept in QUICK_RENDER_DIR as `<name>.ansi`. The
+# first line is a key made from the topic's size and mtime (and the file's
+# inode outside the pack), so any change to the topic invalidates it. Bump
+# RENDER_VERSION whenever colorized output changes.
+
+RENDER_VERSION = 1
+
+def render_path(topic, subtopic=None):
+  return os.path.join(QUICK_RENDER_DIR, cache_name(topic, subtopic) + '.ansi')
+
+def render_key(size, mtime, ino=0):
+  return 'quick-render %d %d %r %d\n' % (RENDER_VERSION, size, mtime, ino)
+
+def blob_render_key(sha):
+  return 'quick-render %d %s\n' % (RENDER_VERSION, sha)
+
+# print_rendered: copy a rendered file to stdout if it starts with `key` (from
+# TopicStore.render_key). Returns False on a miss.
+def print_rendered(key, rendered_path):
+  if not key:
+    return False
+  try:
+    f = open(rendered_path, 'rb')
+  except (IOError, OSError):
+    return False
+
+  with f:
+    if f.readline() != key:
+      return False
+    out = buffered_stdout()
+    try:
+      shutil.copyfileobj(f, out)
+    finally:
+      out.flush()
+  return True
+
+# write_rendered: write colored `lines` to `out` and atomically replace
+# `rendered_path` with them (temp file + rename)
+def write_rendered(rendered_path, key, lines, out=None):
+  import tempfile
+  tmp_path = None
+  try:
+    if not os.path.isdir(QUICK_RENDER_DIR):
+      os.makedirs(QUICK_RENDER_DIR)
+    fd, tmp_path = tempfile.mkstemp(dir=QUICK_RENDER_DIR, suffix='.tmp')
+    cache = os.fdopen(fd, 'wb')
+  except (IOError, OSError):
+    cache = None  # Unwritable cache: just print
+
+  try:
+    if cache:
+      cache.write(key)
+    for line in lines:
+      if out:
+        out.write(line)
+      if cache:
+        cache.write(line)
+    if out:
+      out.write('\n')
+    if cache:
+      cache.write('\n')
+      cache.close()
+      os.rename(tmp_path, rendered_path)
+      tmp_path = None
+  finally:
+    if tmp_path:
+      if cache:
+        cache.close()
+      os.remove(tmp_path)
+
+# Pre-render
+# ---------------------------------------------------------
+# After an update the changed topics are rendered in a process pool so the
+# first view is already warm.
+
+# _prerender: render one topic into the rendered cache
+def _prerender(name):
+  store = topic_store()
+  key = store.render_key(name)
+  data = store.data(name)
+  if key and data is not None:
+    write_rendered(os.path.join(QUICK_RENDER_DIR, name + '.ansi'), key, [colorize_markdown(data[:])])
+
+# _changed_topic_names: (rendered, removed) topic names from git_changes
+def _changed_topic_names(changes):
+  rendered, removed = [], []
+  for status, path, new_path in changes:
+    if status in 'RD':
+      removed.append(path)
+    if status in 'RC':
+      rendered.append(new_path)
+    elif status != 'D':
+      rendered.append(path)
+  ext = '.md'
+  names = lambda paths: [p[0:-len(ext)] for p in paths if p.endswith(ext) and '/' not in p]
+  return names(rendered), names(removed)
+
+def prerender_changes(changes, jobs=None):
+  import multiprocessing
+  rendered, removed = _changed_topic_names(changes)
+
+  for name in removed:
+    try:
+      os.remove(os.path.join(QUICK_RENDER_DIR, name + '.ansi'))
+    except OSError:
+      pass
+
+  jobs = jobs or multiprocessing.cpu_count()
+  if jobs == 1 or len(rendered) < 2:
+    for name in rendered:
+      _prerender(name)
+  else:
+    pool = multiprocessing.Pool(min(jobs, len(rendered)))
+    try:
+      pool.map(_prerender, rendered, chunksize=max(1, len(rendered) // (jobs * 4)))
+    finally:
+      pool.close()
+      pool.join()
 
 COLOR_CODES = {
     'black':    '0;30',     'bright gray':  '0;37',
@@ -336,9 +995,1631 @@ COLOR_CODES = {
     'normal':   '0'
 }
 
+COLOR_END = "\033[0m"
+
 def color(text, color):
   """Return a string wrapped in ANSI color"""
-  return "\033["+COLOR_CODES[color]+"m"+text+"\033[0m"
+  return "\033["+COLOR_CODES[color]+"m"+text+COLOR_END
+
+# Escape sequence that starts the color of each LineState
+STATE_COLOR_STARTS = dict((state, "\033["+COLOR_CODES[color_for_state(state)]+"m") for state in _ALL_STATES)
+
+# Indexes
+# =========================================================
+
+# Tables
+# ---------------------------------------------------------
+# Immutable key/value files read through mmap, so opening one costs nothing
+# and a lookup only touches the pages it needs:
+#
+#   '<4sII'              magic, count, len(meta)
+#   meta                 free-form header string
+#   (count + 1) x '<I'   key offsets
+#   (count + 1) x '<I'   value offsets
+#   keys, values
+#
+# `find` binary searches, so write keys in sorted order to use it.
+
+TABLE_MAGIC = 'QTB1'
+_tableHeader = struct.Struct('<4sII')
+
+def write_table(path, items, meta=''):
+  keys, values = [], []
+  key_offsets, value_offsets = [0], [0]
+  for key, value in items:
+    keys.append(key)
+    values.append(value)
+    key_offsets.append(key_offsets[-1] + len(key))
+    value_offsets.append(value_offsets[-1] + len(value))
+  count = len(keys)
+  write_atomic(path, ''.join([
+    _tableHeader.pack(TABLE_MAGIC, count, len(meta)), meta,
+    struct.pack('<%dI' % (count + 1), *key_offsets),
+    struct.pack('<%dI' % (count + 1), *value_offsets),
+  ] + keys + values))
+
+class Table:
+  def __init__(self, path):
+    import mmap
+    with open(path, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.count, meta_len = _tableHeader.unpack_from(self.mm)
+    if magic != TABLE_MAGIC:
+      raise ValueError('%s is not a table' % path)
+    start = _tableHeader.size
+    self.meta = self.mm[start:start + meta_len]
+    self._key_offsets = start + meta_len
+    self._value_offsets = self._key_offsets + 4 * (self.count + 1)
+    self._keys = self._value_offsets + 4 * (self.count + 1)
+    self._values = self._keys + self._offset(self._key_offsets, self.count)
+
+  def __len__(self):
+    return self.count
+
+  def _offset(self, base, i):
+    return struct.unpack_from('<I', self.mm, base + 4 * i)[0]
+
+  def key(self, i):
+    start, end = struct.unpack_from('<II', self.mm, self._key_offsets + 4 * i)
+    return self.mm[self._keys + start:self._keys + end]
+
+  def value(self, i):
+    start, end = struct.unpack_from('<II', self.mm, self._value_offsets + 4 * i)
+    return self.mm[self._values + start:self._values + end]
+
+  # value_buffer: value(i) as a read-only buffer over the map (no copy)
+  def value_buffer(self, i):
+    start, end = struct.unpack_from('<II', self.mm, self._value_offsets + 4 * i)
+    return buffer(self.mm, self._values + start, end - start)
+
+  # bisect: first index whose key is >= `key`
+  def bisect(self, key):
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.key(mid) < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  # find: index of `key`, or -1
+  def find(self, key):
+    i = self.bisect(key)
+    if i < self.count and self.key(i) == key:
+      return i
+    return -1
+
+# Topic Index
+# ---------------------------------------------------------
+# Every topic name in QUICK_CACHE_DIR as a sorted Table (name => '<Id' size,
+# mtime), rebuilt after each update. Opening it is an mmap, and every query
+# is a binary search:
+#
+#   index.exists('git:config')
+#   index.subtopics('git')             => ['git:config', 'git:log', ...]
+#   index.topics_with_prefix('ku')     => ['kubectl', 'kubernetes']
+#
+# The meta records the cache directory's mtime, which changes whenever a
+# topic file is added, removed or replaced, so a stale index is ignored. With
+# QUICK_STORE=git the names come from HEAD's tree and the meta records HEAD.
+#
+# Next to it, .index/trigrams maps each trigram of the names' ':' separated
+# parts to varint deltas of topic ids (positions in the topic index), so
+# `suggest` only compares a missing name against names sharing trigrams.
+#
+# .index/names lists the same names one per line, in byte order, for the shell
+# completion scripts to search with `look` without starting Python.
+#
+# Topics can also come from the directories in QUICK_SOURCES (say a team's
+# runbooks checkout), read before the cache in the order listed. The index
+# merges them: each name is listed once, with the number of the source that
+# has it first, so finding a topic is one lookup rather than a stat per
+# source. The meta then also records the sources and their mtimes.
+#
+# A directory's mtime doesn't change when a file in it is edited in place.
+# That doesn't change which source has a topic either, so views and listings
+# only check the meta. What holds copies of the sources' topics does need to
+# know: .index/sources lists them (name => entry), and checked_sources_index
+# stats each of those files against its entry before the search index or
+# database is used or --update runs. The pack and database stat the one topic
+# they are asked for instead (_source_edited).
+
+TOPIC_INDEX_VERSION = 2
+topicEntry = struct.Struct('<IdH')  # size, mtime, source
+SOURCES_CHECK_INTERVAL = 1.0
+
+# Suggestions
+FUZZY_LIMIT = 5
+FUZZY_CANDIDATES = 50
+FUZZY_MIN_RATIO = 0.5
+FUZZY_MAX_POSTINGS = 4096  # Bytes of postings read for a very common trigram
+
+def topic_index_path():
+  return os.path.join(QUICK_INDEX_DIR, 'topics')
+
+def trigram_index_path():
+  return os.path.join(QUICK_INDEX_DIR, 'trigrams')
+
+def names_path():
+  return os.path.join(QUICK_INDEX_DIR, 'names')
+
+def source_topics_path():
+  return os.path.join(QUICK_INDEX_DIR, 'sources')
+
+# trigrams: set of trigrams of each ':' part of `name`, padded so short and
+# leading parts still produce some ('git' => '  g', ' gi', 'git', 'it ')
+def trigrams(name):
+  grams = set()
+  for part in name.lower().split(':'):
+    padded = '  ' + part + ' '
+    grams.update(padded[i:i + 3] for i in xrange(len(padded) - 2))
+  return grams
+
+# topic_sources: directories topics are read from, first match wins
+def topic_sources():
+  return QUICK_SOURCES + [QUICK_CACHE_DIR]
+
+# sources_stamp: a hash of QUICK_SOURCES and their mtimes ('-' when there are
+# none), which changes when a topic is added to or removed from one
+def sources_stamp():
+  if not QUICK_SOURCES:
+    return '-'
+  import hashlib
+  state = []
+  for directory in QUICK_SOURCES:
+    try:
+      state.append('%s %r' % (directory, os.stat(directory).st_mtime))
+    except OSError:
+      state.append(directory)
+  return hashlib.sha1('\n'.join(state)).hexdigest()[:16]
+
+# _source_topics: (name, entry) of every topic from QUICK_SOURCES in the index
+# with `meta`
+def _source_topics(meta):
+  table = Table(source_topics_path())
+  if table.meta != meta:
+    raise ValueError('%s does not match the topic index' % source_topics_path())
+  return [(table.key(i), table.value(i)) for i in xrange(len(table))]
+
+# _source_topics_current: False when a topic file in QUICK_SOURCES was changed
+# since the index with `meta` was built
+def _source_topics_current(meta):
+  directories = topic_sources()
+  for name, entry in _source_topics(meta):
+    size, mtime, source = topicEntry.unpack(entry)
+    try:
+      stat = os.stat(os.path.join(directories[source], name + '.md'))
+    except OSError:
+      return False
+    if stat.st_size != size or stat.st_mtime != mtime:
+      return False
+  return True
+
+# source_topics_stamp: a hash of the entries of the topics from QUICK_SOURCES
+# ('-' when there are none), which changes with any of those topics
+def source_topics_stamp():
+  index = checked_sources_index() if QUICK_SOURCES else None
+  if not index:
+    return '-'
+  import hashlib
+  return hashlib.sha1(''.join(name + '\0' + entry for name, entry in _source_topics(index.table.meta))).hexdigest()[:16]
+
+# topic_index_meta: the current state of the cache, as written in the meta of
+# the topic index and everything built with it
+def topic_index_meta():
+  if QUICK_STORE == 'git':
+    meta = 'quick-topics %d git %s' % (TOPIC_INDEX_VERSION, read_git_head(QUICK_CACHE_DIR))
+  else:
+    meta = 'quick-topics %d %r' % (TOPIC_INDEX_VERSION, os.stat(QUICK_CACHE_DIR).st_mtime)
+  if QUICK_SOURCES:
+    meta += ' ' + sources_stamp()
+  return meta
+
+class TopicIndex:
+  def __init__(self, path=None):
+    self.table = Table(path or topic_index_path())
+
+  def __len__(self):
+    return len(self.table)
+
+  def exists(self, name):
+    return self.table.find(name) != -1
+
+  # stat: (size, mtime) of a topic, or None
+  def stat(self, name):
+    i = self.table.find(name)
+    if i == -1:
+      return None
+    return topicEntry.unpack(self.table.value(i))[:2]
+
+  # source: directory a topic is read from (see topic_sources), or None
+  def source(self, name):
+    i = self.table.find(name)
+    if i == -1:
+      return None
+    return topic_sources()[topicEntry.unpack(self.table.value(i))[2]]
+
+  def names(self):
+    return [self.table.key(i) for i in xrange(len(self.table))]
+
+  # names_with_prefix: every name (topics and subtopics) starting with `prefix`
+  def names_with_prefix(self, prefix):
+    table = self.table
+    start = table.bisect(prefix)
+    # No name holds a 0xff byte (not valid UTF-8), so this ends the range
+    end = table.bisect(prefix + '\xff')
+    return [table.key(i) for i in xrange(start, end)]
+
+  def subtopics(self, topic):
+    return self.names_with_prefix(topic + ':')
+
+  # topics_with_prefix: topics (not subtopics) starting with `prefix`
+  def topics_with_prefix(self, prefix):
+    return [name for name in self.names_with_prefix(prefix) if name.find(':') == -1]
+
+  # suggest: up to `limit` existing names closest to `name`, best first.
+  # Candidates come from trigram postings (rarest first), and only the
+  # FUZZY_CANDIDATES sharing the most trigrams are compared in full.
+  def suggest(self, name, limit=FUZZY_LIMIT):
+    import difflib
+    grams = Table(trigram_index_path())
+    postings = []
+    for gram in trigrams(name):
+      i = grams.find(gram)
+      if i != -1:
+        postings.append(grams.value(i))
+    postings.sort(key=len)
+
+    # Very common trigrams add little: skip them once rarer ones matched, and
+    # when every trigram is common read only the start of the rarest
+    shared = {}
+    for data in postings:
+      if len(data) > FUZZY_MAX_POSTINGS:
+        if shared:
+          break
+        data = data[:FUZZY_MAX_POSTINGS]
+      topic = 0
+      for delta in decode_varints(data):
+        topic += delta
+        shared[topic] = shared.get(topic, 0) + 1
+
+    query = name.lower()
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(query)
+    def similarity(candidate):
+      best = 0.0
+      for text in [candidate] + candidate.split(':'):
+        matcher.set_seq1(text.lower())
+        best = max(best, matcher.ratio())
+      return best
+
+    candidates = heapq.nlargest(FUZZY_CANDIDATES, shared.iteritems(), key=lambda item: (item[1], -item[0]))
+    scored = [(similarity(self.table.key(topic)), self.table.key(topic)) for topic, count in candidates]
+    scored = [item for item in scored if item[0] >= FUZZY_MIN_RATIO]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [candidate for ratio, candidate in scored[:limit]]
+
+# load_topic_index: current TopicIndex, or None when missing or stale
+def load_topic_index():
+  try:
+    index = TopicIndex()
+    meta = topic_index_meta()
+  except (IOError, OSError, ValueError):
+    return None
+  if index.table.meta != meta:
+    return None
+  return index
+
+# topic_index: load_topic_index, building the index when the topics are only
+# in git (QUICK_STORE=git) or spread over QUICK_SOURCES, where there is no
+# single directory to fall back to
+def topic_index():
+  index = load_topic_index()
+  if not index and (QUICK_STORE == 'git' or QUICK_SOURCES):
+    try:
+      index = build_topic_index()
+    except BaseException:
+      return None
+  return index
+
+def build_topic_index():
+  if QUICK_STORE == 'git':
+    read_git_head(QUICK_CACHE_DIR)  # Raises before creating anything when there is no clone
+  # Create our own directories first: doing so changes the cache mtime
+  for directory in (QUICK_INDEX_DIR, QUICK_RENDER_DIR):
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+  meta = topic_index_meta()
+
+  ext = '.md'
+  entries = []
+  blobs = []
+  seen = set()
+  for source, directory in enumerate(topic_sources()):
+    if QUICK_STORE == 'git' and directory == QUICK_CACHE_DIR:
+      for name, sha, size in git_tree_entries(QUICK_CACHE_DIR):
+        if name not in seen:
+          entries.append((name, topicEntry.pack(size, 0, source)))
+          blobs.append((name, sha))
+      continue
+    try:
+      fnames = os.listdir(directory)
+    except OSError:
+      continue  # A missing source has no topics
+    for fname in fnames:
+      if fname.startswith('.') or not fname.endswith(ext) or fname[0:-len(ext)] in seen:
+        continue
+      stat = os.stat(os.path.join(directory, fname))
+      entries.append((fname[0:-len(ext)], topicEntry.pack(stat.st_size, stat.st_mtime, source)))
+    seen.update(name for name, entry in entries)
+  # Sort by name, not file name: 'git-lfs.md' < 'git.md' but 'git' < 'git-lfs'
+  entries.sort()
+
+  postings = {}
+  for topic, (name, entry) in enumerate(entries):
+    for gram in trigrams(name):
+      postings.setdefault(gram, []).append(topic)
+  grams = []
+  for gram in sorted(postings):
+    topics = postings[gram]
+    grams.append((gram, encode_varints([topics[0]] + [b - a for a, b in zip(topics, topics[1:])])))
+
+  aliases = _alias_items(entries, dict(blobs))
+  write_table(trigram_index_path(), grams, meta=meta)
+  write_table(alias_index_path(), aliases, meta=meta)
+  write_atomic(names_path(), ''.join(name + '\n' for name, entry in entries))
+  if QUICK_SOURCES:
+    extra = len(QUICK_SOURCES)
+    write_table(source_topics_path(), [item for item in entries if topicEntry.unpack(item[1])[2] < extra], meta=meta)
+  if QUICK_STORE == 'git':
+    write_table(blob_index_path(), sorted(blobs), meta=meta)
+    _gitStores.clear()
+  if QUICK_STORE in ('pack', 'zpack'):
+    write_pack(entries, meta)
+  elif QUICK_STORE == 'sqlite':
+    write_database(entries, meta)
+  write_table(topic_index_path(), entries, meta=meta)
+  _sourceIndexes.clear()
+  return TopicIndex()
+
+# _current_topic_index: load_topic_index, building it when stale
+def _current_topic_index():
+  index = load_topic_index()
+  if not index and os.path.isdir(QUICK_CACHE_DIR):
+    index = build_topic_index()
+  return index
+
+# Current topic index by meta
+_sourceIndexes = {}
+
+# sources_index: _current_topic_index for reads with QUICK_SOURCES set,
+# loaded once per meta so a scan doesn't reopen it for every topic
+def sources_index():
+  meta = topic_index_meta()
+  index = _sourceIndexes.get(meta)
+  if not index:
+    index = _current_topic_index()
+    _sourceIndexes.clear()
+    if index:
+      _sourceIndexes[index.table.meta] = index
+  return index
+
+# Time the topics from QUICK_SOURCES were last checked, by index meta
+_sourcesChecked = {}
+
+# checked_sources_index: sources_index, rebuilt when a topic file in
+# QUICK_SOURCES was edited in place. That stats every such file, so it is
+# done at most every SOURCES_CHECK_INTERVAL seconds.
+def checked_sources_index():
+  import time
+  index = sources_index()
+  if not index:
+    return None
+  checked = _sourcesChecked.get(index.table.meta)
+  if checked and time.time() - checked < SOURCES_CHECK_INTERVAL:
+    return index
+  try:
+    current = _source_topics_current(index.table.meta)
+  except (IOError, OSError, ValueError):
+    current = False
+  if not current:
+    index = build_topic_index()
+  _sourcesChecked.clear()
+  _sourcesChecked[index.table.meta] = time.time()
+  return index
+
+# _source_edited: True when topic `name` is from QUICK_SOURCES and its file
+# was edited in place since the index (and the pack or database built with
+# it) was written
+def _source_edited(name):
+  index = sources_index()
+  i = index.table.find(name) if index else -1
+  if i == -1:
+    return False
+  size, mtime, source = topicEntry.unpack(index.table.value(i))
+  if source >= len(QUICK_SOURCES):
+    return False
+  try:
+    stat = os.stat(os.path.join(QUICK_SOURCES[source], name + '.md'))
+  except OSError:
+    return True
+  return stat.st_size != size or stat.st_mtime != mtime
+
+def suggest_topics(name, limit=FUZZY_LIMIT):
+  index = _current_topic_index()
+  if not index:
+    return []
+  return index.suggest(name, limit)
+
+# Aliases
+# ---------------------------------------------------------
+# .index/aliases maps the normalized form of every name to the names that
+# have it, so `quick Git`, `quick git-config` and `quick git:Config` find
+# git and git:config. Names listed in a topic's front matter are added too:
+#
+#   ---
+#   aliases: [k8s, kube]
+#   ---
+#
+# makes `quick k8s` show that topic. A topic's own names come first.
+
+FRONT_MATTER_MAX = 4096  # Bytes of a topic searched for its front matter
+
+def alias_index_path():
+  return os.path.join(QUICK_INDEX_DIR, 'aliases')
+
+# normalize_topic: `name` lowercased, with '_', ' ' and ':' folded to '-'
+def normalize_topic(name):
+  return name.lower().replace('_', '-').replace(' ', '-').replace(':', '-')
+
+# front_matter_aliases: names declared by `aliases:` (or `alias:`) in the
+# front matter at the start of `text`, inline ([a, b] or a, b) or as a list
+def front_matter_aliases(text):
+  if not text.startswith('---\n'):
+    return []
+  end = text.find('\n---', 3)
+  if end == -1:
+    return []
+  aliases = []
+  in_list = False
+  for line in text[4:end].split('\n'):
+    if in_list and line.lstrip().startswith('-'):
+      aliases.append(line.lstrip()[1:])
+      continue
+    key, colon, value = line.partition(':')
+    in_list = colon and key.strip() in ('alias', 'aliases') and not value.strip()
+    if colon and key.strip() in ('alias', 'aliases'):
+      aliases.extend(value.strip().strip('[]').split(','))
+  aliases = [alias.strip().strip('\'"') for alias in aliases]
+  return [alias for alias in aliases if alias]
+
+# _alias_items: sorted (normalized, names) items for index `entries`. Front
+# matter is read only for topics that changed since the previous index (by
+# size and mtime, or blob sha in `blobs` for QUICK_STORE=git).
+def _alias_items(entries, blobs):
+  items = lambda table: dict((table.key(i), table.value(i)) for i in xrange(len(table)))
+  previous = {}
+  try:
+    old_entries = items(TopicIndex().table)
+    old_aliases = Table(alias_index_path())
+    old_blobs = items(Table(blob_index_path())) if blobs else {}
+  except (IOError, OSError, ValueError):
+    old_entries = {}
+  if old_entries:
+    for i in xrange(len(old_aliases)):
+      key = old_aliases.key(i)
+      for name in old_aliases.value(i).split('\n'):
+        if normalize_topic(name) != key:
+          previous.setdefault(name, []).append(key)
+
+  def unchanged(name, entry):
+    if old_entries.get(name) != entry:
+      return False
+    return old_blobs.get(name) == blobs.get(name)
+
+  files = FileStore(entries)
+  def head(name):
+    if name in blobs:
+      blob = git_store().read_object(blobs[name])
+      return blob[1][:FRONT_MATTER_MAX] if blob else ''
+    data = files.data(name)
+    return data[:FRONT_MATTER_MAX] if data is not None else ''
+
+  keys = {}
+  for name, entry in entries:
+    keys.setdefault(normalize_topic(name), []).append(name)
+  for name, entry in entries:
+    if unchanged(name, entry):
+      aliases = previous.get(name, [])
+    else:
+      aliases = [normalize_topic(alias) for alias in front_matter_aliases(head(name))]
+    for key in aliases:
+      if name not in keys.setdefault(key, []):
+        keys[key].append(name)
+  return [(key, '\n'.join(keys[key])) for key in sorted(keys)]
+
+# resolve_topic: the name `name` most likely means (by normalized name or
+# alias), or None
+def resolve_topic(name):
+  index = _current_topic_index()
+  if not index:
+    return None
+  try:
+    aliases = Table(alias_index_path())
+  except (IOError, OSError, ValueError):
+    return None
+  i = aliases.find(normalize_topic(name))
+  if i == -1:
+    return None
+  return aliases.value(i).split('\n')[0]
+
+# Topic Stores
+# ---------------------------------------------------------
+# Where topic bodies are read from, chosen by QUICK_STORE:
+#
+#   files   (default) each topic's .md file in QUICK_CACHE_DIR
+#   pack    .index/pack, a Table of every topic body in name order, written
+#           with the topic index after each update
+#   zpack   the same pack with each body compressed on its own against a
+#           dictionary trained on the topics (zstd when the zstandard module
+#           is installed, otherwise zlib)
+#   git     blobs of HEAD's tree, read from the cache repository by one
+#           long-lived `git cat-file --batch`, so the cache can be a bare or
+#           partial clone (install.sh clones bare for QUICK_STORE=git)
+#   sqlite  .index/topics.db, see SQLite Store
+#
+# The pack turns thousands of small files into one, so viewing or scanning
+# topics opens a single mmap instead of an inode per topic. A stale or missing
+# pack falls back to the files.
+#
+# Stores hand out topic bytes without copying them (an mmap or a buffer over
+# one; zpack decompresses and git reads just the topic asked for), which
+# split_lines, regexes and stdout all read directly:
+#
+#   store = topic_store()
+#   store.data('git:config')           => bytes, or None when missing
+#   store.render_key('git:config')     => rendered cache key, or None
+#
+# The pack's meta is the topic index meta, the codec name and the codec's
+# state (its dictionary), each up to a '\n'.
+
+STORE_TYPES = ('files', 'pack', 'zpack', 'git', 'sqlite')
+
+PACK_DICT_SIZE = 1 << 15  # zlib can only look back 32KB
+
+# use_store: read topics from `store` (one of STORE_TYPES) from now on (main
+# puts back its own when it returns)
+def use_store(store):
+  global QUICK_STORE
+  QUICK_STORE = store
+
+def pack_path():
+  return os.path.join(QUICK_INDEX_DIR, 'pack')
+
+class FileStore:
+  # `entries`: the (name, entry) items of an index being built, to find
+  # topics by instead of the current topic index
+  def __init__(self, entries=None):
+    self.sources = None
+    if entries is not None and QUICK_SOURCES:
+      directories = topic_sources()
+      self.sources = dict((name, directories[topicEntry.unpack(entry)[2]]) for name, entry in entries)
+
+  def path(self, name):
+    directory = None
+    if self.sources is not None:
+      directory = self.sources.get(name)
+    elif QUICK_SOURCES:
+      index = sources_index()
+      directory = index and index.source(name)
+    return os.path.join(directory or QUICK_CACHE_DIR, name + '.md')
+
+  def data(self, name):
+    import mmap
+    try:
+      with open(self.path(name), 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+      return ''  # Empty files cannot be mapped
+    except (IOError, OSError):
+      return None
+
+  def render_key(self, name):
+    try:
+      stat = os.stat(self.path(name))
+    except OSError:
+      return None
+    return render_key(stat.st_size, stat.st_mtime, stat.st_ino)
+
+class PackStore:
+  def __init__(self):
+    self.index = TopicIndex()
+    self.table = Table(pack_path())
+    self.meta, codec, state = self.table.meta.split('\n', 2)
+    if self.meta != self.index.table.meta:
+      raise ValueError('%s does not match the topic index' % pack_path())
+    self.codec = PACK_CODECS[codec](state)
+
+  def data(self, name):
+    if QUICK_SOURCES and _source_edited(name):
+      return FileStore().data(name)
+    i = self.table.find(name)
+    if i == -1:
+      return None
+    return self.codec.decompress(self.table.value_buffer(i))
+
+  def render_key(self, name):
+    if QUICK_SOURCES and _source_edited(name):
+      return FileStore().render_key(name)
+    stat = self.index.stat(name)
+    if not stat:
+      return None
+    return render_key(*stat)
+
+def blob_index_path():
+  return os.path.join(QUICK_INDEX_DIR, 'blobs')
+
+# GitStore: blobs are looked up by the sha recorded in .index/blobs (written
+# with the topic index), since git finds `HEAD:<path>` by scanning the tree
+# and that is slow for a tree of thousands of topics
+class GitStore:
+  def __init__(self, directory):
+    self.directory = directory
+    self.proc = None
+    self.pid = None
+    self._last = (None, None)
+    try:
+      self.blobs = Table(blob_index_path())
+      if self.blobs.meta != topic_index_meta():
+        self.blobs = None
+    except (IOError, OSError, ValueError):
+      self.blobs = None
+
+  # _cat_file: this process's `git cat-file --batch` (pool workers start
+  # their own rather than share the parent's pipes)
+  def _cat_file(self):
+    import subprocess
+    if not self.proc or self.pid != os.getpid():
+      self.proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.directory, bufsize=-1,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+      self.pid = os.getpid()
+    return self.proc
+
+  # _object: name of the blob of topic `name` for cat-file, or None
+  def _object(self, name):
+    if self.blobs:
+      i = self.blobs.find(name)
+      return self.blobs.value(i) if i != -1 else None
+    if QUICK_SOURCES:
+      index = sources_index()
+      if index and index.source(name) != self.directory:
+        return None  # Shadowed by or only in another source
+    if '\n' in name:
+      return None
+    return 'HEAD:%s.md' % name
+
+  # read_object: (sha, data) of blob `obj` (a sha or '<rev>:<path>'), or None,
+  # also when git can't start or its cat-file has exited (not a repository)
+  def read_object(self, obj):
+    try:
+      proc = self._cat_file()
+      proc.stdin.write(obj + '\n')
+      proc.stdin.flush()
+      # '<sha> <type> <size>' then the contents, or '<object> missing'
+      fields = proc.stdout.readline().split(' ')
+      if len(fields) == 3 and fields[2].strip().isdigit():
+        data = proc.stdout.read(int(fields[2]) + 1)[:-1]
+        if fields[1] == 'blob':
+          return fields[0], data
+    except (IOError, OSError):
+      self.proc = None
+    return None
+
+  # _blob: (sha, data) of topic `name`, or None. The last answer is kept,
+  # since a view asks for the render key and then the data.
+  def _blob(self, name):
+    if self._last[0] == name:
+      return self._last[1]
+    obj = self._object(name)
+    blob = self.read_object(obj) if obj else None
+    self._last = (name, blob)
+    return blob
+
+  def data(self, name):
+    blob = self._blob(name)
+    if not blob and QUICK_SOURCES:
+      return FileStore().data(name)  # From another source
+    return blob[1] if blob else None
+
+  # render_key: from the recorded sha when there is one, so a rendered cache
+  # hit does not start git at all
+  def render_key(self, name):
+    if self.blobs:
+      obj = self._object(name)
+    else:
+      blob = self._blob(name)
+      obj = blob and blob[0]
+    if not obj and QUICK_SOURCES:
+      return FileStore().render_key(name)
+    return blob_render_key(obj) if obj else None
+
+# git_store: the GitStore of QUICK_CACHE_DIR, reused so a scan pays for one
+# cat-file process
+_gitStores = {}
+
+def git_store():
+  store = _gitStores.get(QUICK_CACHE_DIR)
+  if not store:
+    store = _gitStores[QUICK_CACHE_DIR] = GitStore(QUICK_CACHE_DIR)
+  return store
+
+# Open PackStore by path and the cache meta it matches, so scans reuse one
+# mapping
+_packStores = {}
+
+# topic_store: PackStore when QUICK_STORE is 'pack' or 'zpack' and that pack
+# is current, otherwise FileStore
+def topic_store():
+  if QUICK_STORE == 'git':
+    return git_store()
+  if QUICK_STORE == 'sqlite':
+    return sqlite_store() or FileStore()
+  if QUICK_STORE not in ('pack', 'zpack'):
+    return FileStore()
+  try:
+    meta = topic_index_meta()
+    store = _packStores.get((pack_path(), meta))
+    if not store:
+      store = PackStore()
+      if store.meta != meta:
+        return FileStore()
+      _packStores.clear()
+      _packStores[pack_path(), meta] = store
+    return store
+  except (IOError, OSError, ValueError, KeyError):
+    return FileStore()
+
+# topic_store_current: False when QUICK_STORE wants a pack that is out of date
+# or uses another codec
+def topic_store_current():
+  if QUICK_STORE == 'sqlite':
+    return sqlite_store() is not None
+  if QUICK_STORE not in ('pack', 'zpack'):
+    return True
+  store = topic_store()
+  return isinstance(store, PackStore) and _pack_codec_fits(store.codec.name)
+
+# Pack Codecs
+# ---------------------------------------------------------
+
+class PlainCodec:
+  name = 'plain'
+
+  def __init__(self, state=''):
+    self.state = state
+
+  def compress(self, data):
+    return data
+
+  def decompress(self, data):
+    return data
+
+# ZlibCodec: raw deflate with a preset dictionary. Python 2's zlib has no
+# `zdict`, so the dictionary is compressed first and the stream sync flushed;
+# that prefix is the codec state. Copying the primed (de)compressor gives a
+# stream whose window already holds the dictionary, and only what follows the
+# prefix is stored per topic.
+class ZlibCodec:
+  name = 'zlib'
+
+  def __init__(self, state):
+    import zlib
+    self.state = state
+    self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    self._dictionary = self._decompressor.decompress(state)
+    self._compressor = None
+
+  @classmethod
+  def train(cls, samples):
+    import zlib
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+    return cls(compressor.compress(train_dictionary(samples)) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+  def compress(self, data):
+    import zlib
+    if not self._compressor:
+      self._compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+      self._compressor.compress(self._dictionary)
+      self._compressor.flush(zlib.Z_SYNC_FLUSH)
+    compressor = self._compressor.copy()
+    return compressor.compress(data) + compressor.flush()
+
+  def decompress(self, data):
+    return self._decompressor.copy().decompress(data)
+
+# ZstdCodec: zstd with a trained dictionary (the state)
+class ZstdCodec:
+  name = 'zstd'
+
+  def __init__(self, state):
+    import zstandard
+    self.state = state
+    self._dictionary = zstandard.ZstdCompressionDict(state)
+    self._compressor = None
+    self._decompressor = zstandard.ZstdDecompressor(dict_data=self._dictionary)
+
+  @classmethod
+  def train(cls, samples):
+    import zstandard
+    try:
+      return cls(zstandard.train_dictionary(PACK_DICT_SIZE * 4, samples).as_bytes())
+    except zstandard.ZstdError:
+      return ZlibCodec.train(samples)  # Too few samples to train on
+
+  def compress(self, data):
+    import zstandard
+    if not self._compressor:
+      self._compressor = zstandard.ZstdCompressor(level=19, dict_data=self._dictionary)
+    return self._compressor.compress(data)
+
+  def decompress(self, data):
+    return self._decompressor.decompress(data)
+
+PACK_CODECS = {'plain': PlainCodec, 'zlib': ZlibCodec, 'zstd': ZstdCodec}
+
+def _pack_codec_name():
+  if QUICK_STORE != 'zpack':
+    return 'plain'
+  try:
+    import zstandard
+  except ImportError:
+    return 'zlib'
+  return 'zstd'
+
+# _pack_codec_fits: True when a pack with codec `name` will do for
+# QUICK_STORE. A zstd pack may be zlib, which ZstdCodec.train falls back to:
+# rebuilding it would only fall back again.
+def _pack_codec_fits(name):
+  wanted = _pack_codec_name()
+  return name == wanted or (wanted == 'zstd' and name == 'zlib')
+
+# train_dictionary: up to `size` bytes of lines shared by several `samples`,
+# most valuable (bytes saved) last, where matches are cheapest to encode
+def train_dictionary(samples, size=PACK_DICT_SIZE):
+  counts = {}
+  for sample in samples:
+    for line in set(sample.split('\n')):
+      if len(line) >= 4:
+        counts[line] = counts.get(line, 0) + 1
+  shared = [(count * len(line), line) for line, count in counts.iteritems() if count > 1]
+  chosen = []
+  total = 0
+  for saved, line in sorted(shared, reverse=True):
+    if total + len(line) + 1 > size:
+      continue
+    chosen.append(line)
+    total += len(line) + 1
+  return ''.join(line + '\n' for line in reversed(chosen))
+
+# write_pack: write the pack for index `entries`, reusing the stored bytes of
+# topics whose size and mtime did not change (and with them the previous
+# codec and dictionary). A new dictionary is trained only when there is no
+# pack with the same codec.
+def write_pack(entries, meta):
+  codec_name = _pack_codec_name()
+  try:
+    old = PackStore()
+  except (IOError, OSError, ValueError, KeyError):
+    old = None
+  if old and not _pack_codec_fits(old.codec.name):
+    old = None
+
+  files = FileStore(entries)
+  items = []
+  fresh = []
+  for name, entry in entries:
+    if old:
+      i = old.index.table.find(name)
+      if i != -1 and old.index.table.value(i) == entry:
+        items.append((name, old.table.value(old.table.find(name))))
+        continue
+    data = files.data(name)
+    fresh.append(len(items))
+    items.append((name, data[:] if data is not None else ''))
+
+  if old:
+    codec = old.codec
+  elif codec_name == 'plain':
+    codec = PlainCodec()
+  else:
+    codec = PACK_CODECS[codec_name].train([items[i][1] for i in fresh])
+
+  for i in fresh:
+    items[i] = (items[i][0], codec.compress(items[i][1]))
+  write_table(pack_path(), items, meta='%s\n%s\n%s' % (meta, codec.name, codec.state))
+  _packStores.clear()
+
+# Varints: unsigned LEB128, used for posting lists
+
+def encode_varints(numbers):
+  out = bytearray()
+  for n in numbers:
+    while n > 0x7f:
+      out.append((n & 0x7f) | 0x80)
+      n >>= 7
+    out.append(n)
+  return str(out)
+
+def decode_varints(data):
+  numbers = []
+  n = shift = 0
+  for byte in bytearray(data):
+    n |= (byte & 0x7f) << shift
+    if byte & 0x80:
+      shift += 7
+    else:
+      numbers.append(n)
+      n = shift = 0
+  return numbers
+
+# Search
+# ---------------------------------------------------------
+# Inverted index over the contents of every topic, in QUICK_INDEX_DIR:
+#
+#   search.docs    Table: topic name => '<IB' (token count, segment), in doc
+#                  id order. Freed ids have an empty name until reused.
+#   search.terms   Base segment, Table: sorted term => varint postings, a
+#                  (doc id delta, term frequency, line offset) triple per
+#                  topic. The offset is the start of the first line using
+#                  the term, which is where search snippets come from.
+#   search.delta   Delta segment, same format: postings of every topic
+#                  added or changed since the base was built.
+#
+# An update only rewrites the doc table and the small delta segment: changed
+# topics move to the delta segment, whose postings win over any left in the
+# base. Once the delta and freed ids outgrow SEARCH_COMPACT_RATIO of the
+# index, it is rebuilt from scratch.
+#
+# The doc table's meta is:
+#
+#   quick-search <version> <cache mtime> <sources> <head> <base id> <delta id> <docs> <tokens>
+#
+# where <sources> is source_topics_stamp(). Changes in QUICK_SOURCES come with
+# no git diff to apply, so they rebuild the index.
+
+SEARCH_VERSION = 4
+SEARCH_COMPACT_RATIO = 0.25
+SEARCH_LIMIT = 20
+SNIPPET_WIDTH = 72
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+Segment = enum('BASE', 'DELTA', 'FREE')
+searchDoc = struct.Struct('<IB')
+wordExp = re.compile('[a-z0-9]+')
+
+def search_docs_path():
+  return os.path.join(QUICK_INDEX_DIR, 'search.docs')
+
+def search_terms_path():
+  return os.path.join(QUICK_INDEX_DIR, 'search.terms')
+
+def search_delta_path():
+  return os.path.join(QUICK_INDEX_DIR, 'search.delta')
+
+# tokenize: lowercase terms of `text`
+def tokenize(text):
+  return wordExp.findall(text.lower())
+
+# _topic_terms: {term: [frequency, first line offset]} of a topic. Its name
+# counts as content (found on the first line).
+def _topic_terms(name, text):
+  terms = {}
+  for m in wordExp.finditer(text.lower()):
+    term = m.group()
+    if term in terms:
+      terms[term][0] += 1
+    else:
+      terms[term] = [1, text.rfind('\n', 0, m.start()) + 1]
+  for term in tokenize(name):
+    terms.setdefault(term, [0, 0])[0] += 1
+  return terms
+
+# _read_topic_terms: _topic_terms of a stored topic, or None when missing
+def _read_topic_terms(name):
+  data = topic_store().data(name)
+  if data is None:
+    return None
+  return _topic_terms(name, data[:])
+
+# _encode_postings: {term: [(doc, tf, offset)]} => sorted [(term, varints)]
+def _encode_postings(postings):
+  terms = []
+  for term in sorted(postings):
+    numbers = []
+    last = 0
+    for doc, tf, offset in sorted(postings[term]):
+      numbers.extend((doc - last, tf, offset))
+      last = doc
+    terms.append((term, encode_varints(numbers)))
+  return terms
+
+def _decode_postings(data):
+  numbers = decode_varints(data)
+  doc = 0
+  postings = []
+  for j in xrange(0, len(numbers), 3):
+    doc += numbers[j]
+    postings.append((doc, numbers[j + 1], numbers[j + 2]))
+  return postings
+
+def _try_git_head(directory):
+  try:
+    return git_head(directory)
+  except BaseException:
+    return '-'
+
+# _write_search_index: write the delta segment (and base, when given) and
+# then the doc table that ties them together. `docs` is [[name, tokens, segment]].
+def _write_search_index(docs, delta, head, base=None, base_id=None):
+  if not os.path.isdir(QUICK_INDEX_DIR):
+    os.makedirs(QUICK_INDEX_DIR)
+  delta_id = os.urandom(4).encode('hex')
+  if base is not None:
+    base_id = os.urandom(4).encode('hex')
+    write_table(search_terms_path(), _encode_postings(base), meta=base_id)
+  write_table(search_delta_path(), _encode_postings(delta), meta=delta_id)
+
+  live = [doc for doc in docs if doc[2] != Segment.FREE]
+  meta = 'quick-search %d %r %s %s %s %s %d %d' % (SEARCH_VERSION, os.stat(QUICK_CACHE_DIR).st_mtime,
+    source_topics_stamp(), head, base_id, delta_id, len(live), sum(doc[1] for doc in live))
+  write_table(search_docs_path(), [(name, searchDoc.pack(tokens, segment)) for name, tokens, segment in docs], meta=meta)
+
+def build_search_index(head=None):
+  if head is None:
+    head = _try_git_head(QUICK_CACHE_DIR)
+  docs = []
+  postings = {}
+  for doc, name in enumerate(cache_list(None)):
+    terms = _read_topic_terms(name) or {}
+    for term, (tf, offset) in terms.iteritems():
+      postings.setdefault(term, []).append((doc, tf, offset))
+    docs.append([name, sum(tf for tf, offset in terms.itervalues()), Segment.BASE])
+  _write_search_index(docs, {}, head, base=postings)
+
+# update_search_index: apply git_changes between `old_head` and `new_head`,
+# touching only the postings of changed topics
+def update_search_index(changes, old_head, new_head):
+  try:
+    index = SearchIndex()
+  except (IOError, OSError, ValueError):
+    index = None
+  if not index or index.head != old_head or index.sources != source_topics_stamp():
+    return build_search_index(new_head)
+  if not changes:
+    # Nothing new upstream, but a stale index was changed some other way
+    return None if index.is_current() else build_search_index(new_head)
+
+  docs = [index.doc(i) for i in xrange(len(index.docs))]
+  ids = dict((doc[0], i) for i, doc in enumerate(docs) if doc[2] != Segment.FREE)
+  touched = set()
+
+  updated, removed = _changed_topic_names(changes)
+  for name in removed:
+    doc = ids.pop(name, None)
+    if doc is not None:
+      docs[doc] = ['', 0, Segment.FREE]
+      touched.add(doc)
+
+  # Reuse freed ids lowest first
+  free = [i for i in reversed(xrange(len(docs))) if docs[i][2] == Segment.FREE]
+  added = {}
+  for name in updated:
+    terms = _read_topic_terms(name)
+    if terms is None:
+      continue
+    doc = ids.get(name)
+    if doc is None:
+      doc = free.pop() if free else len(docs)
+      if doc == len(docs):
+        docs.append(None)
+      ids[name] = doc
+    added[doc] = terms
+    docs[doc] = [name, sum(tf for tf, offset in added[doc].itervalues()), Segment.DELTA]
+    touched.add(doc)
+
+  # Compact once the delta or free ids are a large part of the index
+  moved = sum(1 for doc in docs if doc[2] != Segment.BASE)
+  if moved > SEARCH_COMPACT_RATIO * len(docs):
+    return build_search_index(new_head)
+
+  delta = {}
+  for term, postings in index.delta_postings():
+    postings = [posting for posting in postings if posting[0] not in touched]
+    if postings:
+      delta[term] = postings
+  for doc, terms in added.iteritems():
+    for term, (tf, offset) in terms.iteritems():
+      delta.setdefault(term, []).append((doc, tf, offset))
+
+  _write_search_index(docs, delta, new_head, base_id=index.base_id)
+
+class SearchIndex:
+  def __init__(self):
+    self.docs = Table(search_docs_path())
+    self.terms = Table(search_terms_path())
+    self.delta = Table(search_delta_path())
+    fields = self.docs.meta.split(' ')
+    if fields[0] != 'quick-search' or int(fields[1]) != SEARCH_VERSION:
+      raise ValueError('unknown search index version')
+    self.cache_mtime, self.sources, self.head, self.base_id, delta_id = fields[2:7]
+    self.count, self.tokens = int(fields[7]), int(fields[8])
+    if self.terms.meta != self.base_id or self.delta.meta != delta_id:
+      raise ValueError('search index segments do not match')
+
+  def is_current(self):
+    return self.cache_mtime == repr(os.stat(QUICK_CACHE_DIR).st_mtime) and self.sources == source_topics_stamp()
+
+  # doc: [name, tokens, segment] of a doc id
+  def doc(self, doc):
+    tokens, segment = searchDoc.unpack(self.docs.value(doc))
+    return [self.docs.key(doc), tokens, segment]
+
+  def segment(self, doc):
+    return searchDoc.unpack(self.docs.value(doc))[1]
+
+  def delta_postings(self):
+    for i in xrange(len(self.delta)):
+      yield self.delta.key(i), _decode_postings(self.delta.value(i))
+
+  # postings: [(doc id, term frequency, line offset)] for `term`, from
+  # whichever segment holds each doc
+  def postings(self, term):
+    postings = []
+    for table, segment in ((self.terms, Segment.BASE), (self.delta, Segment.DELTA)):
+      i = table.find(term)
+      if i != -1:
+        postings.extend(p for p in _decode_postings(table.value(i)) if self.segment(p[0]) == segment)
+    return postings
+
+  def name(self, doc):
+    return self.docs.key(doc)
+
+  # search: [(name, score, line offset)] of the `limit` best topics for
+  # `query` by BM25. The offset is the first line using a query term.
+  def search(self, query, limit=SEARCH_LIMIT):
+    if not self.count:
+      return []
+    average_tokens = float(self.tokens) / self.count
+    scores = {}
+    offsets = {}
+    for term in set(tokenize(query)):
+      postings = self.postings(term)
+      if not postings:
+        continue
+      df = len(postings)
+      idf = math.log(1.0 + (self.count - df + 0.5) / (df + 0.5))
+      for doc, tf, offset in postings:
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc(doc)[1] / average_tokens)
+        scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        offsets[doc] = min(offset, offsets.get(doc, offset))
+    best = heapq.nsmallest(limit, scores.iteritems(), key=lambda item: (-item[1], item[0]))
+    return [(self.name(doc), score, offsets[doc]) for doc, score in best]
+
+# load_search_index: SearchIndex for the current cache, building it if it is
+# missing or stale
+def load_search_index():
+  try:
+    index = SearchIndex()
+    if index.is_current():
+      return index
+  except (IOError, OSError, ValueError):
+    pass
+  build_search_index()
+  return SearchIndex()
+
+def search_topics(query, limit=SEARCH_LIMIT):
+  if QUICK_STORE == 'sqlite':
+    if QUICK_SOURCES:
+      checked_sources_index()  # Rebuilds the database when a source's topic changed
+    store = sqlite_store()
+    if store:
+      return store.search(query, limit)
+  return load_search_index().search(query, limit)
+
+# search_snippet: one line of topic `name` starting at `offset`, trimmed to
+# SNIPPET_WIDTH around the first of `terms`, with terms highlighted
+def search_snippet(name, offset, terms, color_mode=ColorMode.OFF):
+  data = topic_store().data(name)
+  if data is None:
+    return ''
+  m = lineEndExp.search(data, offset)
+  line = data[offset:m.start() if m else len(data)][:4096].strip()
+
+  termsExp = re.compile('(?<![a-z0-9])(?:%s)(?![a-z0-9])' % ('|'.join(re.escape(term) for term in terms) or '$^'), re.IGNORECASE)
+  m = termsExp.search(line)
+  if len(line) > SNIPPET_WIDTH:
+    start = max(0, (m.start() if m else 0) - SNIPPET_WIDTH // 4)
+    line = line[start:start + SNIPPET_WIDTH]
+  if color_mode == ColorMode.ON:
+    line = termsExp.sub(lambda m: color(m.group(), 'yellow'), line)
+  return line
+
+# SQLite Store
+# ---------------------------------------------------------
+# QUICK_STORE=sqlite mirrors the topics into .index/topics.db, updated in one
+# transaction after each update. The database is in WAL mode, so views keep
+# reading while `--update` writes. Lookups, listings and search (FTS5, ranked
+# by its bm25) are indexed queries:
+#
+#   topics       (id, name, topic, subtopic, body, blob, stat)
+#   topics_fts   FTS5 over topics' name and body, kept in sync by triggers
+#   meta         ('topics', topic index meta) for staleness
+
+SQLITE_MMAP_SIZE = 1 << 28
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS topics (
+  id INTEGER PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL,
+  topic TEXT NOT NULL,
+  subtopic TEXT NOT NULL,
+  body TEXT NOT NULL,
+  blob TEXT NOT NULL,
+  stat BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS topics_topic ON topics (topic, name);
+CREATE VIRTUAL TABLE IF NOT EXISTS topics_fts USING fts5(name, body, content='topics', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS topics_insert AFTER INSERT ON topics BEGIN
+  INSERT INTO topics_fts (rowid, name, body) VALUES (new.id, new.name, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS topics_delete AFTER DELETE ON topics BEGIN
+  INSERT INTO topics_fts (topics_fts, rowid, name, body) VALUES ('delete', old.id, old.name, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS topics_update AFTER UPDATE ON topics BEGIN
+  INSERT INTO topics_fts (topics_fts, rowid, name, body) VALUES ('delete', old.id, old.name, old.body);
+  INSERT INTO topics_fts (rowid, name, body) VALUES (new.id, new.name, new.body);
+END;
+"""
+
+def database_path():
+  return os.path.join(QUICK_INDEX_DIR, 'topics.db')
+
+# git_blob_id: the sha git gives `data` as a blob
+def git_blob_id(data):
+  import hashlib
+  return hashlib.sha1('blob %d\0%s' % (len(data), data)).hexdigest()
+
+def _connect_database():
+  import sqlite3
+  db = sqlite3.connect(database_path(), timeout=30)
+  db.text_factory = str
+  db.execute('PRAGMA mmap_size = %d' % SQLITE_MMAP_SIZE)
+  return db
+
+class SqliteStore:
+  def __init__(self):
+    import sqlite3
+    if not os.path.exists(database_path()):
+      raise IOError('%s does not exist' % database_path())
+    try:
+      self.db = _connect_database()
+      self.db.execute('PRAGMA query_only = 1')
+      row = self.db.execute("SELECT value FROM meta WHERE key = 'topics'").fetchone()
+    except sqlite3.Error as e:
+      raise ValueError(str(e))
+    self.meta = row[0] if row else None
+
+  def data(self, name):
+    if QUICK_SOURCES and _source_edited(name):
+      return FileStore().data(name)
+    row = self.db.execute('SELECT body FROM topics WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+  def render_key(self, name):
+    if QUICK_SOURCES and _source_edited(name):
+      return FileStore().render_key(name)
+    row = self.db.execute('SELECT blob FROM topics WHERE name = ?', (name,)).fetchone()
+    return blob_render_key(row[0]) if row else None
+
+  # names: like cache_list, subtopics of `topic`, or every name (`deep`) or
+  # topic
+  def names(self, topic=None, deep=True):
+    if topic:
+      rows = self.db.execute("SELECT name FROM topics WHERE topic = ? AND subtopic != '' ORDER BY name", (topic,))
+    elif deep:
+      rows = self.db.execute('SELECT name FROM topics ORDER BY name')
+    else:
+      rows = self.db.execute("SELECT name FROM topics WHERE subtopic = '' ORDER BY name")
+    return [row[0] for row in rows]
+
+  # search: like SearchIndex.search, any of the terms of `query` ranked by
+  # FTS5's bm25
+  def search(self, query, limit=SEARCH_LIMIT):
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+      return []
+    match = ' OR '.join('"%s"' % term for term in terms)
+    rows = self.db.execute('SELECT topics.name, bm25(topics_fts), topics.body FROM topics_fts '
+      'JOIN topics ON topics.id = topics_fts.rowid WHERE topics_fts MATCH ? '
+      'ORDER BY bm25(topics_fts), topics.name LIMIT ?', (match, limit))
+    termsExp = re.compile('(?<![a-z0-9])(?:%s)(?![a-z0-9])' % '|'.join(terms), re.IGNORECASE)
+    results = []
+    for name, rank, body in rows:
+      m = termsExp.search(body)
+      results.append((name, -rank, body.rfind('\n', 0, m.start()) + 1 if m else 0))
+    return results
+
+# write_database: bring the database in line with index `entries` in one
+# transaction, rewriting only topics whose size or mtime changed
+def write_database(entries, meta):
+  db = _connect_database()
+  try:
+    db.execute('PRAGMA journal_mode = WAL')
+    db.executescript(SQLITE_SCHEMA)
+    files = FileStore(entries)
+    with db:
+      old = dict((name, str(stat)) for name, stat in db.execute('SELECT name, stat FROM topics'))
+      for name, entry in entries:
+        if old.pop(name, None) == entry:
+          continue
+        data = files.data(name)
+        body = data[:] if data is not None else ''
+        topic, colon, subtopic = name.partition(':')
+        db.execute('INSERT OR REPLACE INTO topics (id, name, topic, subtopic, body, blob, stat) '
+          'VALUES ((SELECT id FROM topics WHERE name = ?), ?, ?, ?, ?, ?, ?)',
+          (name, name, topic, subtopic, body, git_blob_id(body), buffer(entry)))
+      db.executemany('DELETE FROM topics WHERE name = ?', [(name,) for name in old])
+      db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('topics', ?)", (meta,))
+  finally:
+    db.close()
+  _sqliteStores.clear()
+
+# Open SqliteStore by path and the cache meta it matches
+_sqliteStores = {}
+
+# sqlite_store: SqliteStore for the current cache, or None when it is stale
+def sqlite_store():
+  try:
+    meta = topic_index_meta()
+    store = _sqliteStores.get((database_path(), meta))
+    if not store:
+      store = SqliteStore()
+      if store.meta != meta:
+        return None
+      _sqliteStores.clear()
+      _sqliteStores[database_path(), meta] = store
+    return store
+  except (IOError, OSError, ValueError):
+    return None
+
+# Grep
+# ---------------------------------------------------------
+# Regex scan over topics, split across a process pool. Each worker runs the
+# regex on the topic's mapped bytes (TopicStore.data); only matching lines are
+# copied back.
+
+GREP_SERIAL_FILES = 32
+
+# Last '\n' before `endpos` (buffers have no rfind, and `\Z` matches at endpos)
+lastLineEndExp = re.compile(r'\n[^\n]*\Z')
+
+# _grep_file: (pattern, flags, name) => (name, [matching lines])
+def _grep_file(args):
+  pattern, flags, name = args
+  exp = re.compile(pattern, flags)
+  data = topic_store().data(name)
+  if data is None:
+    return name, []
+
+  lines = []
+  pos = 0
+  while pos <= len(data):
+    m = exp.search(data, pos)
+    if not m:
+      break
+    start = lastLineEndExp.search(data, pos, m.start())
+    start = start.start() + 1 if start else pos
+    end = lineEndExp.search(data, m.end())
+    end = end.start() if end else len(data)
+    lines.append(data[start:end])
+    pos = end + 1
+  return name, lines
+
+# grep_topics: (name, line) for lines of `topic` and its subtopics (or every
+# topic) matching `pattern`, in topic order as workers finish
+def grep_topics(pattern, topic=None, jobs=None, flags=re.MULTILINE):
+  re.compile(pattern, flags)  # Raise bad patterns here, not in a worker
+  if topic:
+    names = cache_list(topic)
+    if cache_file_exists(topic):
+      names.insert(0, topic)
+  else:
+    names = cache_list(None)
+  items = [(pattern, flags, name) for name in names]
+
+  import multiprocessing
+  jobs = jobs or multiprocessing.cpu_count()
+  pool = None
+  if jobs == 1 or len(items) < GREP_SERIAL_FILES:
+    results = itertools.imap(_grep_file, items)
+  else:
+    pool = multiprocessing.Pool(jobs)
+    results = pool.imap(_grep_file, items, chunksize=max(1, len(items) // (jobs * 8)))
+
+  try:
+    for name, lines in results:
+      for line in lines:
+        yield name, line
+  finally:
+    if pool:
+      pool.terminate()
+
+# Completions
+# =========================================================
+# `quick --completions bash|zsh|fish` prints a script to source from the
+# shell's startup file. Completing a topic runs `look` (a binary search, with
+# an awk scan as fallback) on .index/names, so no keypress starts Python:
+#
+#   quick gi<TAB>         => git, gist
+#   quick git:co<TAB>     => git:config, git:commit
+#   quick gi+<TAB>        => git+, gist+     (also '/')
+
+COMPLETION_SHELLS = ('bash', 'zsh', 'fish')
+
+COMPLETION_OPTIONS = ('--help', '--list', '--edit', '--web', '--update', '--search', '--grep',
+  '--color', '--nocolor', '--no-render-cache', '--no-prerender', '--jobs', '--store', '--version', '--completions')
+
+# _quick_names PREFIX: names starting with PREFIX. Without a ':' in PREFIX only
+# topics are listed, each once (subtopics follow their topic in byte order).
+# The names file's path is filled in by completion_script: the shell may not
+# have QUICK_DIR, which the installed wrapper only sets for quick itself.
+_COMPLETION_NAMES_SH = r"""
+_quick_look() {
+  if command -v look >/dev/null 2>&1; then
+    LC_ALL=C look -- "$1" "$2"
+  else
+    P="$1" LC_ALL=C awk 'index($0, ENVIRON["P"]) == 1 { print; found = 1; next } found { exit }' "$2"
+  fi
+}
+
+_quick_names() {
+  local names=%(names)s
+  [ -r "$names" ] || return 0
+  case $1 in
+    *:*) _quick_look "$1" "$names" ;;
+    *) _quick_look "$1" "$names" | awk -F: '!seen[$1]++ { print $1 }' ;;
+  esac
+}
+"""
+
+COMPLETION_SCRIPTS = {
+  'bash': r"""# quick completion for bash: eval "$(quick --completions bash)"
+""" + _COMPLETION_NAMES_SH + r"""
+_quick() {
+  # The whole word: COMP_WORDS is split at ':' by COMP_WORDBREAKS
+  local cur=${COMP_LINE:0:COMP_POINT}
+  cur=${cur##*[[:space:]]}
+  COMPREPLY=()
+
+  case ${COMP_WORDS[COMP_CWORD-1]} in
+    --completions) COMPREPLY=($(compgen -W "bash zsh fish" -- "$cur")); return ;;
+    --store) COMPREPLY=($(compgen -W "%(stores)s" -- "$cur")); return ;;
+    -j|--jobs|-g|--grep) return ;;
+  esac
+  case $cur in
+    -*) COMPREPLY=($(compgen -W "%(options)s" -- "$cur")); return ;;
+    \?*) return ;;
+  esac
+
+  # Complete the name before a '+' (edit) or '/' (web) and keep the suffix
+  local suffix=
+  case $cur in
+    *+|*/) suffix=${cur: -1}; cur=${cur%%?} ;;
+  esac
+
+  # Bash only replaces the text after the last word break
+  local replaced=
+  case $COMP_WORDBREAKS in
+    *:*) case $cur in *:*) replaced=${cur%%:*}: ;; esac ;;
+  esac
+
+  local IFS=$'\n' name
+  for name in $(_quick_names "$cur"); do
+    COMPREPLY+=("${name#"$replaced"}$suffix")
+  done
+}
+
+complete -F _quick quick
+""",
+
+  'zsh': r"""#compdef quick
+# quick completion for zsh: eval "$(quick --completions zsh)" after compinit
+""" + _COMPLETION_NAMES_SH + r"""
+_quick() {
+  local cur=$PREFIX suffix=
+
+  case ${words[CURRENT-1]} in
+    --completions) compadd bash zsh fish; return ;;
+    --store) compadd %(stores)s; return ;;
+    -j|--jobs|-g|--grep) return 1 ;;
+  esac
+  case $cur in
+    -*) compadd -- %(options)s; return ;;
+    \?*) return 1 ;;
+  esac
+
+  # Complete the name before a '+' (edit) or '/' (web) and keep the suffix
+  case $cur in
+    *+|*/) suffix=${cur[-1]}; cur=${cur%%?} ;;
+  esac
+
+  local -a names
+  names=(${(f)"$(_quick_names "$cur")"})
+  (( ${#names} )) && compadd -U -- ${^names}$suffix
+}
+
+compdef _quick quick
+""",
+
+  'fish': r"""# quick completion for fish: quick --completions fish | source
+function __quick_look
+    if command -sq look
+        env LC_ALL=C look -- $argv[1] $argv[2]
+    else
+        env P=$argv[1] LC_ALL=C awk 'index($0, ENVIRON["P"]) == 1 { print; found = 1; next } found { exit }' $argv[2]
+    end
+end
+
+function __quick_names
+    set -l names %(fish_names)s
+    test -r $names; or return 0
+    if string match -q -- '*:*' $argv[1]
+        __quick_look $argv[1] $names
+    else
+        __quick_look $argv[1] $names | awk -F: '!seen[$1]++ { print $1 }'
+    end
+end
+
+function __quick_topics
+    set -l cur (commandline -ct)
+    string match -q -- '-*' $cur; and return
+    string match -q -- '[?]*' $cur; and return
+
+    # Complete the name before a '+' (edit) or '/' (web) and keep the suffix
+    set -l suffix
+    if string match -qr -- '[+/]$' $cur
+        set suffix (string sub -s -1 -- $cur)
+        set cur (string replace -r '.$' '' -- $cur)
+    end
+    for name in (__quick_names $cur)
+        echo $name$suffix
+    end
+end
+
+complete -c quick -f -a '(__quick_topics)'
+complete -c quick -l completions -x -a 'bash zsh fish'
+complete -c quick -l store -x -a '%(stores)s'
+complete -c quick -s j -l jobs -x
+complete -c quick -s g -l grep -x
+%(fish_options)s
+""",
+}
+
+# completion_script: the completion script for `shell`
+def completion_script(shell):
+  plain = [option for option in COMPLETION_OPTIONS if option not in ('--completions', '--store', '--jobs', '--grep')]
+  import pipes
+  return COMPLETION_SCRIPTS[shell] % {
+    'names': pipes.quote(names_path()),
+    'fish_names': "'%s'" % names_path().replace('\\', '\\\\').replace("'", "\\'"),
+    'options': ' '.join(COMPLETION_OPTIONS),
+    'stores': ' '.join(STORE_TYPES),
+    'fish_options': '\n'.join('complete -c quick -l %s' % option[2:] for option in plain),
+  }
 
 # Commands
 # =========================================================
@@ -354,11 +2635,11 @@ def command_usage():
 
 def command_help():
   print 'command_help'
-  parser.print_help()
+  sys.stdout.write(LONG_USAGE)
   return Exit.SUCCESS
 
-def command_update():
-  quick_update(quiet=False)
+def command_update(jobs=None, prerender=True):
+  quick_update(quiet=False, jobs=jobs, prerender=prerender)
   return Exit.SUCCESS
 
 def command_list(topic=None):
@@ -367,7 +2648,44 @@ def command_list(topic=None):
     print f
   return Exit.SUCCESS
 
+def command_search(query, color_mode=ColorMode.AUTO):
+  color_mode = detect_color_mode(color_mode)
+  results = search_topics(query)
+  if not results:
+    print 'No topics found.'
+
+  terms = tokenize(query)
+  width = max([len(name) for name, score, offset in results] + [0])
+  for name, score, offset in results:
+    label = name.ljust(width)
+    if color_mode == ColorMode.ON:
+      label = color(label, 'blue')
+    print '%s  %s' % (label, search_snippet(name, offset, terms, color_mode))
+  return Exit.SUCCESS
+
+def command_grep(pattern, topic=None, jobs=None, color_mode=ColorMode.AUTO):
+  color_mode = detect_color_mode(color_mode)
+  try:
+    exp = re.compile(pattern, re.MULTILINE)
+  except re.error as e:
+    die('invalid pattern: %s' % e)
+
+  for name, line in grep_topics(pattern, topic, jobs):
+    if color_mode == ColorMode.ON:
+      name = color(name, 'blue')
+      line = exp.sub(lambda m: color(m.group(), 'yellow'), line)
+    sys.stdout.write('%s:%s\n' % (name, line))
+  return Exit.SUCCESS
+
+def command_completions(shell):
+  # Write the names file now when this install has not updated since it existed
+  if os.path.isdir(QUICK_CACHE_DIR) and not (load_topic_index() and os.path.exists(names_path())):
+    build_topic_index()
+  sys.stdout.write(completion_script(shell))
+  return Exit.SUCCESS
+
 def command_web(topic, subtopic=None, edit=False):
+  import webbrowser
   topic_name = cache_name(topic, subtopic)
 
   wiki_url = 'https://github.com/evanmoran/quick/wiki/%s' % topic_name
@@ -397,91 +2715,226 @@ def command_web(topic, subtopic=None, edit=False):
 def command_edit(topic, subtopic=None):
   return command_web(topic, subtopic, edit=True)
 
-def command_view(topic, subtopic=None, color_mode=ColorMode.AUTO):
-  file_path = cache_path(topic, subtopic)
+def command_view(topic, subtopic=None, color_mode=ColorMode.AUTO, render_cache=True):
+  store = topic_store()
+  topic_name = cache_name(topic, subtopic)
+  color_mode = detect_color_mode(color_mode)
+
+  rendered_path = key = None
+  if color_mode == ColorMode.ON and render_cache:
+    rendered_path = render_path(topic, subtopic)
+    key = store.render_key(topic_name)
+    if print_rendered(key, rendered_path):
+      return Exit.SUCCESS
+
+  data = store.data(topic_name)
+  if data is None:
+    canonical = resolve_topic(topic_name)
+    if canonical and canonical != topic_name:
+      canonical_topic, colon, canonical_subtopic = canonical.partition(':')
+      return command_view(canonical_topic, canonical_subtopic or None, color_mode, render_cache)
 
-  try:
-    f = open(file_path)
-  except:
     name = 'Topic'
     if subtopic != None:
       name = 'Subtopic'
     print '%s not found.' % name
+
+    suggestions = suggest_topics(topic_name)
+    if suggestions:
+      print '\nDid you mean:\n'
+      for suggestion in suggestions:
+        print '  quick %s' % suggestion
   else:
-    with f:
-      print_color(f.read(), color_mode)
+    print_color(data, color_mode, rendered_path, key)
 
   return Exit.SUCCESS
 
 # Parse Arguments
 # =========================================================
 
-class ArgParser(argparse.ArgumentParser):
-  def error(self, message):
-    die(message, Exit.ARGUMENT_ERROR)
-
-  def print_help(self):
-    sys.stdout.write(LONG_USAGE)
-
-parser = ArgParser(add_help=False)
-group = parser.add_mutually_exclusive_group()
-group.add_argument('-e', '--edit', action='store_true', default=False)
-group.add_argument('-l', '--list', action='store_true', default=False)
-group.add_argument('-w', '--web', action='store_true', default=False)
-group.add_argument('-u', '--update', action='store_true', default=False)
-group.add_argument('-h', '--help', action='store_true', default=False)
-group.add_argument('--version', action='store_true', default=False)
-parser.add_argument('--verbose', action='store_true', default=False)
-parser.add_argument('--color', action='store_true', default=False)
-parser.add_argument('--nocolor', action='store_true', default=False)
-
-parser.add_argument('topic', nargs='?', default=None)
-
-args = parser.parse_args()
+def arg_parser():
+  import argparse
+
+  class ArgParser(argparse.ArgumentParser):
+    def error(self, message):
+      die(message, Exit.ARGUMENT_ERROR)
+
+    def print_help(self):
+      sys.stdout.write(LONG_USAGE)
+
+  # positive: an int of at least 1, for counts like --jobs
+  def positive(value):
+    try:
+      number = int(value)
+    except ValueError:
+      number = 0
+    if number < 1:
+      raise argparse.ArgumentTypeError('expected a number of at least 1: %r' % value)
+    return number
+
+  parser = ArgParser(add_help=False)
+  group = parser.add_mutually_exclusive_group()
+  group.add_argument('-e', '--edit', action='store_true', default=False)
+  group.add_argument('-l', '--list', action='store_true', default=False)
+  group.add_argument('-w', '--web', action='store_true', default=False)
+  group.add_argument('-u', '--update', action='store_true', default=False)
+  group.add_argument('-s', '--search', action='store_true', default=False)
+  group.add_argument('-g', '--grep', action='store_true', default=False)
+  group.add_argument('-h', '--help', action='store_true', default=False)
+  group.add_argument('--version', action='store_true', default=False)
+  group.add_argument('--completions', choices=COMPLETION_SHELLS, default=None)
+  parser.add_argument('--verbose', action='store_true', default=False)
+  parser.add_argument('--color', action='store_true', default=False)
+  parser.add_argument('--nocolor', action='store_true', default=False)
+  parser.add_argument('--no-render-cache', dest='render_cache', action='store_false', default=True)
+  parser.add_argument('--no-prerender', dest='prerender', action='store_false', default=True)
+  parser.add_argument('-j', '--jobs', type=positive, default=None)
+  parser.add_argument('--store', choices=STORE_TYPES, default=None)
+
+  parser.add_argument('topic', nargs='?', default=None)
+  parser.add_argument('terms', nargs='*', default=[])
+  return parser
+
+# parse_args: parse `argv` with QUICK_OPTIONS prepended
+def parse_args(argv):
+  import shlex
+  args = arg_parser().parse_args(shlex.split(os.environ.get('QUICK_OPTIONS', '')) + list(argv))
+
+  # Fix color to be ColorMode type
+  args.color_mode = ColorMode.AUTO
+  if args.color:
+    args.color_mode = ColorMode.ON
+  elif args.nocolor:
+    args.color_mode = ColorMode.OFF
+  return args
+
+# Fast Path
+# ----------------------------------------------------------
+# `quick topic[:subtopic]` (plus color flags) is by far the most common
+# command line, so it is recognized without building the ArgParser.
+
+FAST_VIEW_FLAGS = ('--color', '--nocolor', '--no-render-cache')
+
+# fast_view_args: command_view arguments for a plain `topic[:subtopic]`
+# command line, or None when the full parser is needed
+def fast_view_args(argv):
+  options = os.environ.get('QUICK_OPTIONS', '')
+  if '"' in options or "'" in options or '\\' in options:
+    return None
+
+  flags = set()
+  topic = None
+  store = None
+  for arg in options.split() + list(argv):
+    if arg in FAST_VIEW_FLAGS:
+      flags.add(arg)
+    elif arg.startswith('--store=') and arg[len('--store='):] in STORE_TYPES:
+      store = arg[len('--store='):]
+    elif arg.startswith('-') or topic != None:
+      return None
+    else:
+      topic = arg
 
-# Fix color to be ColorMode type
-args.color_mode = ColorMode.AUTO
-if args.color:
-  args.color_mode = ColorMode.ON
-elif args.nocolor:
-  args.color_mode = ColorMode.OFF
+  view = {'color_mode': ColorMode.AUTO, 'render_cache': '--no-render-cache' not in flags, 'store': store}
+  if '--color' in flags:
+    view['color_mode'] = ColorMode.ON
+  elif '--nocolor' in flags:
+    view['color_mode'] = ColorMode.OFF
 
-# pprint(args)
+  parsed_topic = parse_topic(topic)
+  if not parsed_topic['topic'] or parsed_topic['list'] or parsed_topic['edit'] or parsed_topic['web'] or parsed_topic['search']:
+    return None
+  view['topic'] = parsed_topic['topic']
+  view['subtopic'] = parsed_topic['subtopic']
+  return view
 
 # Call Commands
 # ----------------------------------------------------------
 
-# Parse the topic:subtopic if it exists
-parsed_topic = parse_topic(args.topic)
-
-# Version
-if args.version == True:
-  exit(command_version())
-
-# Help
-elif args.help:
-  exit(command_help())
-
-# Update
-elif args.update:
-  exit(command_update())
-
-# List
-elif args.list or parsed_topic['list']:
-  exit(command_list(topic=parsed_topic['topic']))
-
-# None
-elif args.topic == None:
-  exit(command_usage())
-
-# Web
-if args.web or parsed_topic['web']:
-  exit(command_web(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic']))
-
-# Edit
-elif args.edit or parsed_topic['edit']:
-  exit(command_edit(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic']))
+# main: run the command line `argv` (default: sys.argv[1:]), returning the
+# exit code
+# main: run the command line `argv`. A --store applies to this call only,
+# so one in-process call doesn't change the store of the next.
+def main(argv=None):
+  if argv is None:
+    argv = sys.argv[1:]
+  store = QUICK_STORE
+  try:
+    return _main(argv)
+  finally:
+    use_store(store)
+
+def _main(argv):
+  view = fast_view_args(argv)
+  if view:
+    store = view.pop('store')
+    if store:
+      use_store(store)
+    code = command_view(**view)
+    revalidate_cache()
+    return code
+
+  args = parse_args(argv)
+  if args.store:
+    use_store(args.store)
+
+  # Parse the topic:subtopic if it exists
+  parsed_topic = parse_topic(args.topic)
+
+  # Only search and grep take more than one topic argument
+  if args.terms and not (args.search or parsed_topic['search']) and not (args.grep and len(args.terms) == 1):
+    die('unrecognized arguments: %s' % ' '.join(args.terms))
+
+  # Version
+  if args.version == True:
+    return command_version()
+
+  # Help
+  elif args.help:
+    return command_help()
+
+  # Completions
+  elif args.completions:
+    return command_completions(args.completions)
+
+  # Update
+  elif args.update:
+    return command_update(jobs=args.jobs, prerender=args.prerender)
+
+  # Grep
+  elif args.grep:
+    if args.topic == None:
+      die('missing grep pattern')
+    return command_grep(args.topic, (args.terms or [None])[0], jobs=args.jobs, color_mode=args.color_mode)
+
+  # Search
+  elif args.search:
+    return command_search(' '.join(filter(None, [args.topic] + args.terms)), color_mode=args.color_mode)
+
+  elif parsed_topic['search']:
+    return command_search(' '.join(filter(None, [parsed_topic['topic']] + args.terms)), color_mode=args.color_mode)
+
+  # List
+  elif args.list or parsed_topic['list']:
+    return command_list(topic=parsed_topic['topic'])
+
+  # None
+  elif args.topic == None:
+    return command_usage()
+
+  # Web
+  if args.web or parsed_topic['web']:
+    return command_web(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic'])
+
+  # Edit
+  elif args.edit or parsed_topic['edit']:
+    return command_edit(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic'])
+
+  # View
+  else:
+    code = command_view(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic'], color_mode=args.color_mode, render_cache=args.render_cache)
+    revalidate_cache()
+    return code
 
-# View
-else:
-  exit(command_view(topic=parsed_topic['topic'], subtopic=parsed_topic['subtopic'], color_mode=args.color_mode))
+if __name__ == '__main__':
+  sys.exit(main())
@@ -1,3 +1,11 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ['QUICK_AUTO_UPDATE'] = '0'  # Views must not update in the background
+
+import quick
+
 
 class TestHelp:
 
@@ -32,3 +40,938 @@ class TestEdit:
 
   def test_two_arguments(self):
     pass
+
+# Library
+# ---------------------------------------------------------
+
+SAMPLE_MARKDOWN = '\n'.join([
+  '# Git', '', 'Some text', 'Subtitle', '--------', '', '* bullet', 'more',
+  '', '1. one', '2. two', '', '> quote', 'continued', '', '    code', '---', '',
+])
+
+# use_cache_path: make `path` (a py.path) the topics cache
+def use_cache_path(monkeypatch, path):
+  monkeypatch.setattr(quick, 'QUICK_CACHE_DIR', str(path))
+  monkeypatch.setattr(quick, 'QUICK_RENDER_DIR', str(path.join('.rendered')))
+  monkeypatch.setattr(quick, 'QUICK_INDEX_DIR', str(path.join('.index')))
+  return path
+
+def use_cache_dir(monkeypatch, tmpdir):
+  return use_cache_path(monkeypatch, tmpdir.mkdir('cache'))
+
+class TestParseTopic:
+
+  def test_subtopic(self):
+    parsed = quick.parse_topic('git:config')
+    assert parsed['topic'] == 'git' and parsed['subtopic'] == 'config'
+
+  def test_suffixes(self):
+    assert quick.parse_topic('git:')['list']
+    assert quick.parse_topic('git+')['edit']
+    assert quick.parse_topic('git/')['web']
+
+class TestColorize:
+
+  def test_streaming_matches_batch(self):
+    lines = quick.colorize_lines(SAMPLE_MARKDOWN.split('\n'))
+    assert ''.join(lines) == quick.colorize_markdown(SAMPLE_MARKDOWN)
+
+  # lineKindExp repeats classify_line's grammar for colorize_markdown: check
+  # them against each other on the edge lines of the colorize benchmark
+  def test_batch_classifies_like_streaming(self):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+    try:
+      import bench_colorize
+    finally:
+      sys.path.pop(0)
+    for line in bench_colorize.SAMPLE_LINES:
+      assert quick.classify_document(line) == [quick.classify_line(line)], repr(line)
+    for seed in range(20):
+      markdown = bench_colorize.sample_document(200, seed)
+      assert quick.colorize_markdown(markdown) == ''.join(quick.colorize_lines(markdown.split('\n')))
+      assert quick.colorize_markdown(markdown) == bench_colorize.reference_colorize_markdown(markdown)
+
+  def test_states(self):
+    colored = quick.colorize_markdown(SAMPLE_MARKDOWN).split('\n')
+    assert colored[1] == quick.color('# Git', 'blue')
+    assert colored[4] == quick.color('Subtitle', 'blue')
+    assert colored[8] == quick.color('more', 'yellow')
+    assert colored[16] == quick.color('    code', 'cyan')
+
+  def test_split_lines(self):
+    for text in ['', 'a', 'a\n', 'a\n\nb', 'a\nb\n']:
+      assert list(quick.split_lines(text)) == text.split('\n')
+      assert list(quick.split_lines(buffer('x\n' + text, 2))) == text.split('\n')
+
+class TestMain:
+
+  def test_version(self, capsys):
+    assert quick.main(['--version']) == quick.Exit.SUCCESS
+    assert quick.VERSION in capsys.readouterr()[0]
+
+  def test_view(self, monkeypatch, tmpdir, capsys):
+    use_cache_dir(monkeypatch, tmpdir).join('git.md').write(SAMPLE_MARKDOWN)
+    assert quick.main(['--color', 'git']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == quick.colorize_markdown(SAMPLE_MARKDOWN) + '\n'
+
+  def test_view_rendered_cache(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write(SAMPLE_MARKDOWN)
+    quick.main(['--color', 'git'])
+    assert cache_dir.join('.rendered', 'git.ansi').check()
+    quick.main(['--color', 'git'])
+    assert capsys.readouterr()[0] == (quick.colorize_markdown(SAMPLE_MARKDOWN) + '\n') * 2
+
+  def test_list(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    for name in ['git.md', 'git:config.md', 'git:log.md', 'ruby.md']:
+      cache_dir.join(name).write('')
+    assert quick.cache_list('git') == ['git:config', 'git:log']
+    assert quick.cache_list(None, deep=False) == ['git', 'ruby']
+
+class TestTopicIndex:
+
+  def test_topic_index(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    for name in ['git.md', 'git:config.md', 'git:log.md', 'gitk.md', 'kubectl.md', 'ruby.md', 'notes.txt']:
+      cache_dir.join(name).write('x')
+    assert quick.load_topic_index() is None
+    quick.build_topic_index()
+    index = quick.load_topic_index()
+    assert index.names() == ['git', 'git:config', 'git:log', 'gitk', 'kubectl', 'ruby']
+    assert index.stat('git:log')[0] == 1 and index.stat('nope') is None
+    assert index.exists('git:config') and not index.exists('git:')
+    assert index.subtopics('git') == ['git:config', 'git:log']
+    assert index.topics_with_prefix('gi') == ['git', 'gitk']
+    assert index.topics_with_prefix('k') == ['kubectl']
+    assert quick.cache_list('git') == ['git:config', 'git:log']
+    assert quick.cache_list(None, deep=False) == ['git', 'gitk', 'kubectl', 'ruby']
+    assert quick.cache_file_exists('git', 'config')
+    assert not quick.cache_file_exists('git', 'missing')
+
+  def test_stale(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('x')
+    quick.build_topic_index()
+    cache_dir.join('ruby.md').write('x')
+    os.utime(str(cache_dir), (0, 0))
+    assert quick.load_topic_index() is None
+    assert quick.cache_list(None) == ['git', 'ruby']
+
+class TestStartup:
+
+  # Modules the plain view path must not import
+  HEAVY_MODULES = ['argparse', 'subprocess', 'webbrowser', 'multiprocessing', 'glob', 'tempfile']
+
+  def test_view_imports(self, tmpdir):
+    import subprocess
+    cache_dir = tmpdir.mkdir('cache')
+    cache_dir.join('git.md').write(SAMPLE_MARKDOWN)
+    script = '; '.join([
+      'import sys',
+      'sys.path.insert(0, %r)' % os.path.dirname(quick.__file__),
+      'import quick',
+      'quick.main(["git"])',
+      'sys.stderr.write(" ".join(m for m in %r if m in sys.modules))' % self.HEAVY_MODULES,
+    ])
+    env = dict(os.environ, QUICK_DIR=str(tmpdir), QUICK_OPTIONS='')
+    proc = subprocess.Popen([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert out == SAMPLE_MARKDOWN + '\n'
+    assert err == ''
+
+  def test_fast_view_args(self, monkeypatch):
+    monkeypatch.setenv('QUICK_OPTIONS', '--nocolor')
+    view = quick.fast_view_args(['git:config'])
+    assert view['topic'] == 'git' and view['subtopic'] == 'config'
+    assert view['color_mode'] == quick.ColorMode.OFF
+    assert quick.fast_view_args(['git:']) is None
+    assert quick.fast_view_args(['--list', 'git']) is None
+    assert quick.fast_view_args(['--store=sqlite', 'git'])['store'] == 'sqlite'
+    assert quick.fast_view_args(['--store=nope', 'git']) is None
+
+  def test_store_option_per_call(self, monkeypatch, tmpdir, capsys):
+    use_cache_dir(monkeypatch, tmpdir).join('git.md').write('git push\n')
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'files')
+    for argv in (['--store=sqlite', '--nocolor', 'git'], ['--store=pack', '-l']):
+      assert quick.main(argv) == quick.Exit.SUCCESS
+      assert quick.QUICK_STORE == 'files'
+    assert quick.main(['--nocolor', 'git']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0].endswith('git push\n\n')
+
+class TestSearchIndex:
+
+  def test_varints(self):
+    numbers = [0, 1, 127, 128, 300, 2 ** 32]
+    assert quick.decode_varints(quick.encode_varints(numbers)) == numbers
+
+  def test_table(self, tmpdir):
+    path = str(tmpdir.join('table'))
+    quick.write_table(path, [('a', '1'), ('b', ''), ('c', '333')], meta='meta')
+    table = quick.Table(path)
+    assert len(table) == 3 and table.meta == 'meta'
+    assert table.key(2) == 'c' and table.value(2) == '333'
+    assert table.find('b') == 1 and table.find('bb') == -1
+
+  def test_search(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('# Git\n\nrebase and merge\n')
+    cache_dir.join('git:rebase.md').write('rebase rebase rebase\n\n    git rebase -i\n')
+    cache_dir.join('ruby.md').write('# Ruby\n')
+    names = [result[0] for result in quick.search_topics('Rebase')]
+    assert names == ['git:rebase', 'git']
+    assert quick.search_topics('missing') == []
+
+  def test_command(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('merge conflict\n')
+    cache_dir.join('svn.md').write('merge\n')
+    assert quick.main(['?conflict']) == quick.Exit.SUCCESS
+    assert quick.main(['--search', 'merge', 'conflict']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'git  merge conflict\ngit  merge conflict\nsvn  merge\n'
+
+  def test_ranking(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('short.md').write('tag\n')
+    cache_dir.join('long.md').write('tag\n' + 'filler words here\n' * 50)
+    for i in range(30):
+      cache_dir.join('other%d.md' % i).write('tag other\n')
+    results = quick.search_topics('tag', limit=3)
+    assert len(results) == 3
+    assert results[0][0] == 'short'
+    assert results[-1][0] != 'long'
+
+  def test_snippet(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('# Git\n\nUse Rebase to rewrite history\n')
+    name, score, offset = quick.search_topics('rebase')[0]
+    assert offset == len('# Git\n\n')
+    assert quick.search_snippet(name, offset, ['rebase']) == 'Use Rebase to rewrite history'
+    colored = quick.search_snippet(name, offset, ['rebase'], quick.ColorMode.ON)
+    assert colored == 'Use %s to rewrite history' % quick.color('Rebase', 'yellow')
+
+def run_git(directory, *args):
+  import subprocess
+  env = dict(os.environ, GIT_AUTHOR_NAME='t', GIT_AUTHOR_EMAIL='t@t', GIT_COMMITTER_NAME='t', GIT_COMMITTER_EMAIL='t@t')
+  subprocess.check_call(['git'] + list(args), cwd=str(directory), env=env, stdout=open(os.devnull, 'w'))
+
+def commit_all(directory):
+  run_git(directory, 'add', '-A')
+  run_git(directory, 'commit', '-q', '-m', 'update')
+  return quick.git_head(str(directory))
+
+# push_topics: write `topics` ({file name: body, or None to remove}) in the
+# clone `work`, commit and push them to its origin's master
+def push_topics(work, topics):
+  for fname, body in sorted(topics.items()):
+    if body is None:
+      work.join(fname).remove()
+    else:
+      work.join(fname).write(body)
+  commit_all(work)
+  run_git(work, 'push', '-q', 'origin', 'HEAD:master')
+
+# make_origin: a bare repo `<name>.git` and a clone of it, `<name>-work`,
+# that has pushed `topics` to it
+def make_origin(tmpdir, name, topics):
+  origin = tmpdir.join(name + '.git')
+  run_git(tmpdir, 'init', '-q', '--bare', str(origin))
+  work = tmpdir.join(name + '-work')
+  run_git(tmpdir, 'clone', '-q', str(origin), str(work))
+  push_topics(work, topics)
+  return origin, work
+
+class TestSearchUpdate:
+
+  def git(self, cache_dir, *args):
+    run_git(cache_dir, *args)
+
+  def commit(self, cache_dir):
+    return commit_all(cache_dir)
+
+  def test_incremental(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    self.git(cache_dir, 'init', '-q')
+    for i in range(20):
+      cache_dir.join('topic%d.md' % i).write('common words %d\n' % i)
+    cache_dir.join('git.md').write('merge\n')
+    old_head = self.commit(cache_dir)
+    quick.build_search_index(old_head)
+    base_id = quick.SearchIndex().base_id
+
+    cache_dir.join('git.md').write('rebase\n')
+    cache_dir.join('topic1.md').remove()
+    cache_dir.join('new.md').write('rebase merge\n')
+    self.git(cache_dir, 'mv', 'topic2.md', 'renamed.md')
+    new_head = self.commit(cache_dir)
+    quick.update_search_index(quick.git_changes(str(cache_dir), old_head, new_head), old_head, new_head)
+
+    index = quick.SearchIndex()
+    assert index.base_id == base_id and index.head == new_head and index.is_current()
+    assert [result[0] for result in index.search('rebase')] == ['git', 'new']
+    assert [result[0] for result in index.search('merge')] == ['new']
+    assert [result[0] for result in index.search('2')] == ['renamed']
+    assert index.search('1') == []
+    assert index.count == 21
+
+  def test_compaction(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    self.git(cache_dir, 'init', '-q')
+    for i in range(4):
+      cache_dir.join('topic%d.md' % i).write('words\n')
+    old_head = self.commit(cache_dir)
+    quick.build_search_index(old_head)
+    base_id = quick.SearchIndex().base_id
+
+    cache_dir.join('topic0.md').write('changed\n')
+    cache_dir.join('topic1.md').write('changed\n')
+    new_head = self.commit(cache_dir)
+    quick.update_search_index(quick.git_changes(str(cache_dir), old_head, new_head), old_head, new_head)
+
+    index = quick.SearchIndex()
+    assert index.base_id != base_id
+    assert [result[0] for result in index.search('changed')] == ['topic0', 'topic1']
+
+  def test_no_changes_rebuilds_stale(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    self.git(cache_dir, 'init', '-q')
+    cache_dir.join('git.md').write('merge\n')
+    head = self.commit(cache_dir)
+    quick.build_search_index(head)
+
+    cache_dir.join('local.md').write('merge locally\n')
+    os.utime(str(cache_dir), (0, 0))
+    assert not quick.SearchIndex().is_current()
+    quick.update_search_index([], head, head)
+
+    index = quick.SearchIndex()
+    assert index.is_current()
+    assert [result[0] for result in index.search('locally')] == ['local']
+
+class TestPrerender:
+
+  # updated_renders: {name: rendered file} after an update adding, changing,
+  # removing and renaming topics, prerendered with `jobs`
+  def updated_renders(self, monkeypatch, tmpdir, jobs):
+    origin, work = make_origin(tmpdir, 'wiki', {'a.md': '# A\n', 'b.md': '* b\n', 'c.md': '> c\n'})
+    cache_dir = tmpdir.join('cache')
+    run_git(tmpdir, 'clone', '-q', str(origin), str(cache_dir))
+    use_cache_path(monkeypatch, cache_dir)
+    for name in ('a', 'b', 'c'):
+      quick._prerender(name)
+
+    push_topics(work, {'a.md': '# A\n\n* changed\n', 'b.md': None, 'c.md': None, 'f.md': '> c\n', 'e.md': 'new\n'})
+    quick.cache_update(jobs=jobs)
+    renders = {}
+    for fname in os.listdir(quick.QUICK_RENDER_DIR):
+      name = fname[0:-len('.ansi')]
+      with open(os.path.join(quick.QUICK_RENDER_DIR, fname), 'rb') as f:
+        key = f.readline()
+        assert key == quick.topic_store().render_key(name)
+        renders[name] = f.read()
+    return renders
+
+  def test_changed_topic_names(self):
+    changes = [('M', 'a.md', None), ('D', 'b.md', None), ('R', 'c.md', 'f.md'), ('A', 'docs/x.md', None)]
+    assert quick._changed_topic_names(changes) == (['a', 'f'], ['b', 'c'])
+
+  def test_update_prerenders(self, monkeypatch, tmpdir):
+    serial = self.updated_renders(monkeypatch, tmpdir.mkdir('serial'), 1)
+    pool = self.updated_renders(monkeypatch, tmpdir.mkdir('pool'), 4)
+    assert sorted(serial) == ['a', 'e', 'f']
+    assert serial == pool
+    assert serial['a'] == quick.colorize_markdown('# A\n\n* changed\n') + '\n'
+
+class TestGrep:
+
+  def test_grep_topic(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('git push -f\nother\n')
+    cache_dir.join('git:push.md').write('push it\npush -f origin')
+    cache_dir.join('hg.md').write('hg push -f\n')
+    cache_dir.join('empty.md').write('')
+    assert list(quick.grep_topics('push -f', 'git', jobs=1)) == [('git', 'git push -f'), ('git:push', 'push -f origin')]
+    assert [name for name, line in quick.grep_topics('^push', jobs=1)] == ['git:push', 'git:push']
+
+  def test_grep_pool_order(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    for i in range(quick.GREP_SERIAL_FILES * 2):
+      cache_dir.join('topic%03d.md' % i).write('line %d\nmatch %d\n' % (i, i))
+    expected = list(quick.grep_topics('match', jobs=1))
+    assert len(expected) == quick.GREP_SERIAL_FILES * 2
+    assert list(quick.grep_topics('match', jobs=2)) == expected
+
+  def test_command(self, monkeypatch, tmpdir, capsys):
+    use_cache_dir(monkeypatch, tmpdir).join('git.md').write('a\nrebase -i\n')
+    assert quick.main(['--nocolor', '--grep', 'rebase', 'git']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'git:rebase -i\n'
+
+  def test_jobs_at_least_one(self, monkeypatch, tmpdir, capsys):
+    use_cache_dir(monkeypatch, tmpdir).join('git.md').write('rebase -i\n')
+    for jobs in ('-1', '0', 'two'):
+      try:
+        quick.main(['-j', jobs, '--grep', 'rebase'])
+        assert False, 'accepted -j %s' % jobs
+      except SystemExit as error:
+        assert error.code == quick.Exit.ARGUMENT_ERROR
+      assert 'at least 1' in capsys.readouterr()[1]
+    assert quick.parse_args(['-j', '2', '--grep', 'rebase']).jobs == 2
+
+class TestSuggest:
+
+  def test_trigrams(self):
+    assert quick.trigrams('Git') == set(['  g', ' gi', 'git', 'it '])
+    assert 'ctl' in quick.trigrams('kubernetes:kubectl')
+
+  def test_suggest(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    for name in ['git', 'git:config', 'kubernetes', 'kubernetes:kubectl', 'ruby']:
+      cache_dir.join(name + '.md').write('')
+    assert quick.suggest_topics('kubectl')[0] == 'kubernetes:kubectl'
+    assert quick.suggest_topics('gti:confg')[0] == 'git:config'
+    assert quick.suggest_topics('zzzz') == []
+
+  def test_view_suggests(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('ruby.md').write('')
+    quick.main(['--nocolor', 'rubby'])
+    assert capsys.readouterr()[0] == 'Topic not found.\n\nDid you mean:\n\n  quick ruby\n'
+
+class TestCompletions:
+
+  def test_names_file(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    for name in ['git.md', 'git-lfs.md', 'git:config.md', 'ruby.md']:
+      cache_dir.join(name).write('')
+    index = quick.build_topic_index()
+    assert cache_dir.join('.index', 'names').read() == 'git\ngit-lfs\ngit:config\nruby\n'
+    assert index.exists('git-lfs') and index.exists('git')
+
+  def test_scripts(self, monkeypatch, tmpdir, capsys):
+    use_cache_dir(monkeypatch, tmpdir)
+    for shell in quick.COMPLETION_SHELLS:
+      assert quick.main(['--completions', shell]) == quick.Exit.SUCCESS
+      script = capsys.readouterr()[0]
+      assert '.index/names' in script and 'no-render-cache' in script and '%(' not in script
+      assert 'files pack zpack git sqlite' in script  # --store values
+      assert quick.names_path() in script  # Without QUICK_DIR in the shell
+
+class TestPackStore:
+
+  def use_pack(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'pack')
+    cache_dir.join('git.md').write('# Git\ngit push -f\n')
+    cache_dir.join('git:log.md').write('git log -p')
+    cache_dir.join('empty.md').write('')
+    quick.build_topic_index()
+    return cache_dir
+
+  def test_pack(self, monkeypatch, tmpdir, capsys):
+    cache_dir = self.use_pack(monkeypatch, tmpdir)
+    store = quick.topic_store()
+    assert isinstance(store, quick.PackStore)
+    assert store.data('git:log')[:] == 'git log -p'
+    assert store.data('empty')[:] == '' and store.data('missing') is None
+
+    # Reads come from the pack, not the files
+    cache_dir.join('git.md').write('changed!')
+    assert quick.topic_store().data('git')[:] == '# Git\ngit push -f\n'
+    assert list(quick.grep_topics('push', jobs=1)) == [('git', 'git push -f')]
+    assert quick.main(['--nocolor', 'git']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == '# Git\ngit push -f\n\n'
+
+  def test_stale_pack(self, monkeypatch, tmpdir):
+    cache_dir = self.use_pack(monkeypatch, tmpdir)
+    cache_dir.join('ruby.md').write('ruby')
+    os.utime(str(cache_dir), (1, 1))
+    assert isinstance(quick.topic_store(), quick.FileStore)
+    assert not quick.topic_store_current()
+    quick.build_topic_index()
+    assert quick.topic_store().data('ruby')[:] == 'ruby'
+
+  def test_rendered_cache(self, monkeypatch, tmpdir, capsys):
+    cache_dir = self.use_pack(monkeypatch, tmpdir)
+    quick.main(['--color', 'git'])
+    colored = capsys.readouterr()[0]
+    assert cache_dir.join('.rendered', 'git.ansi').read().startswith(quick.topic_store().render_key('git'))
+    quick.main(['--color', 'git'])
+    assert capsys.readouterr()[0] == colored
+
+class TestCompressedPack:
+
+  def test_train_dictionary(self):
+    samples = ['git push -f\nshared line\n', 'shared line\nother\n', 'shared line\ngit push -f\n']
+    assert quick.train_dictionary(samples) == 'git push -f\nshared line\n'
+    assert len(quick.train_dictionary(samples, size=12)) <= 12
+
+  def test_zlib_codec(self):
+    codec = quick.ZlibCodec.train(['$ git push origin master\n' * 3, '$ git push origin master\n'])
+    data = '# Push\n\n$ git push origin master\n'
+    compressed = codec.compress(data)
+    assert len(compressed) < len(data) // 2
+    assert quick.ZlibCodec(codec.state).decompress(buffer(compressed)) == data
+    assert codec.decompress(codec.compress('')) == ''
+
+  def test_zstd_codec(self):
+    try:
+      import zstandard
+    except ImportError:
+      import py
+      py.test.skip('zstandard is not installed')
+    samples = ['# Topic %d\n\n    $ git push origin master\n    $ quick topic%d\n' % (i, i) for i in range(200)]
+    codec = quick.ZstdCodec.train(samples)
+    assert codec.name == 'zstd'
+    compressed = codec.compress(samples[7])
+    assert len(compressed) < len(samples[7])
+    assert quick.ZstdCodec(codec.state).decompress(compressed) == samples[7]
+
+  # A stand-in zstandard that can't train: the pack falls back to zlib, and
+  # that pack is kept rather than rebuilt (and retrained) on every update
+  def test_zstd_fallback(self, monkeypatch, tmpdir):
+    import types
+    zstandard = types.ModuleType('zstandard')
+    class ZstdError(Exception):
+      pass
+    def train_dictionary(size, samples):
+      raise ZstdError('too few samples')
+    zstandard.ZstdError = ZstdError
+    zstandard.train_dictionary = train_dictionary
+    monkeypatch.setitem(sys.modules, 'zstandard', zstandard)
+
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'zpack')
+    cache_dir.join('git.md').write('git push\n')
+    quick.build_topic_index()
+    store = quick.topic_store()
+    assert store.codec.name == 'zlib' and quick.topic_store_current()
+
+    cache_dir.join('new.md').write('    $ quick --update\n')
+    os.utime(str(cache_dir), (1, 1))
+    quick.build_topic_index()
+    assert quick.topic_store().codec.state == store.codec.state
+    assert quick.topic_store().data('new') == '    $ quick --update\n'
+
+  def test_zpack(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'zpack')
+    monkeypatch.setattr(quick, '_pack_codec_name', lambda: 'zlib')
+    for i in range(20):
+      cache_dir.join('topic%d.md' % i).write('# Topic %d\n\n    $ quick --update\n    $ quick topic%d\n' % (i, i))
+    quick.build_topic_index()
+    store = quick.topic_store()
+    assert store.codec.name == 'zlib' and quick.topic_store_current()
+    assert store.data('topic7') == '# Topic 7\n\n    $ quick --update\n    $ quick topic7\n'
+    assert list(quick.grep_topics('topic3$', jobs=1)) == [('topic3', '    $ quick topic3')]
+    assert quick.main(['--nocolor', 'topic1']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0].startswith('# Topic 1\n')
+
+    # New topics reuse the trained dictionary
+    cache_dir.join('new.md').write('    $ quick --update\n')
+    os.utime(str(cache_dir), (1, 1))
+    quick.build_topic_index()
+    assert quick.topic_store().codec.state == store.codec.state
+    assert quick.topic_store().data('new') == '    $ quick --update\n'
+
+class TestGitStore:
+
+  def use_bare_clone(self, monkeypatch, tmpdir):
+    origin, work = make_origin(tmpdir, 'wiki', {'git.md': '# Git\ngit push -f\n', 'git:log.md': 'git log -p'})
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    run_git(tmpdir, 'clone', '-q', '--bare', str(origin), str(cache_dir))
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'git')
+    return work, cache_dir
+
+  def test_git_store(self, monkeypatch, tmpdir, capsys):
+    work, cache_dir = self.use_bare_clone(monkeypatch, tmpdir)
+    assert quick.is_bare(str(cache_dir))
+    assert quick.read_git_head(str(cache_dir)) == quick.git_head(str(cache_dir))
+    store = quick.topic_store()
+    assert store.data('git:log') == 'git log -p' and store.data('nope') is None
+    assert store.render_key('git') == quick.blob_render_key(quick.git(str(cache_dir), ['rev-parse', 'HEAD:git.md'])[1].strip())
+    assert quick.cache_list(None) == ['git', 'git:log']
+    assert list(quick.grep_topics('push', jobs=1)) == [('git', 'git push -f')]
+    assert quick.main(['--nocolor', 'git:log']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'git log -p\n'
+
+  def test_update(self, monkeypatch, tmpdir):
+    work, cache_dir = self.use_bare_clone(monkeypatch, tmpdir)
+    quick.cache_update(prerender=False)
+    push_topics(work, {'ruby.md': 'gem install\n'})
+    quick.cache_update(prerender=False)
+    assert quick.cache_list(None) == ['git', 'git:log', 'ruby']
+    assert quick.topic_store().data('ruby') == 'gem install\n'
+    assert [result[0] for result in quick.search_topics('gem')] == ['ruby']
+
+  def test_missing_cache(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_path(monkeypatch, tmpdir.join('cache'))
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'git')
+    assert quick.main(['--nocolor', '-l']) == quick.Exit.SUCCESS
+    assert quick.main(['--nocolor', 'git']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'Topic not found.\n'
+    assert not cache_dir.check()
+
+  def test_dead_cat_file(self, monkeypatch, tmpdir):
+    store = quick.GitStore(str(tmpdir))  # Not a repository: cat-file exits
+    assert store.read_object('HEAD:git.md') is None
+    assert quick.GitStore(str(tmpdir.join('missing'))).read_object('HEAD:git.md') is None
+
+class TestSqliteStore:
+
+  def use_database(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    monkeypatch.setattr(quick, 'QUICK_STORE', 'sqlite')
+    cache_dir.join('git.md').write('# Git\nUse rebase to rewrite history\n')
+    cache_dir.join('git:log.md').write('git log -p')
+    cache_dir.join('git:rebase.md').write('Rebase onto master\n\ngit rebase -i master rebase\n')
+    cache_dir.join('ruby.md').write('gem install')
+    quick.build_topic_index()
+    return cache_dir
+
+  def test_store(self, monkeypatch, tmpdir, capsys):
+    cache_dir = self.use_database(monkeypatch, tmpdir)
+    store = quick.topic_store()
+    assert isinstance(store, quick.SqliteStore)
+    assert store.data('git:log') == 'git log -p' and store.data('nope') is None
+    assert store.render_key('git:log') == quick.blob_render_key(quick.git_blob_id('git log -p'))
+    assert quick.cache_list('git') == ['git:log', 'git:rebase']
+    assert quick.cache_list(None, deep=False) == ['git', 'ruby']
+    assert quick.cache_list(None) == ['git', 'git:log', 'git:rebase', 'ruby']
+    assert quick.main(['--nocolor', 'git:log']) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'git log -p\n'
+
+  def test_search(self, monkeypatch, tmpdir):
+    self.use_database(monkeypatch, tmpdir)
+    results = quick.search_topics('rebase')
+    assert [name for name, score, offset in results] == ['git:rebase', 'git']
+    assert results[1][2] == len('# Git\n')
+    assert quick.search_topics('nothing') == []
+
+  def test_update(self, monkeypatch, tmpdir):
+    cache_dir = self.use_database(monkeypatch, tmpdir)
+    cache_dir.join('ruby.md').remove()
+    cache_dir.join('git:log.md').write('git log --oneline')
+    cache_dir.join('new.md').write('gem')
+    os.utime(str(cache_dir), (1, 1))
+    assert not quick.topic_store_current()
+    quick.build_topic_index()
+    assert quick.cache_list(None) == ['git', 'git:log', 'git:rebase', 'new']
+    assert quick.topic_store().data('git:log') == 'git log --oneline'
+    assert sorted(result[0] for result in quick.search_topics('gem oneline')) == ['git:log', 'new']
+    assert quick.search_topics('install') == []
+
+class TestAliases:
+
+  def test_front_matter(self):
+    assert quick.front_matter_aliases('---\naliases: [k8s, "kube"]\n---\n# Kubernetes') == ['k8s', 'kube']
+    assert quick.front_matter_aliases('---\ntitle: x\naliases:\n  - k8s\n  - kube\n---\n') == ['k8s', 'kube']
+    assert quick.front_matter_aliases('---\nalias: k8s\n---\n') == ['k8s']
+    assert quick.front_matter_aliases('# aliases: k8s\n') == []
+
+  def test_resolve(self, monkeypatch, tmpdir, capsys):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('# Git')
+    cache_dir.join('git:config.md').write('config')
+    cache_dir.join('kubernetes.md').write('---\naliases: [k8s, Kube Ctl]\n---\n# Kubernetes\n')
+    assert quick.normalize_topic('Git:Some_thing else') == 'git-some-thing-else'
+    assert quick.resolve_topic('Git') == 'git'
+    assert quick.resolve_topic('git-Config') == 'git:config'
+    assert quick.resolve_topic('kube_ctl') == 'kubernetes'
+    assert quick.resolve_topic('nope') is None
+    quick.main(['--nocolor', 'git:Config'])
+    quick.main(['--nocolor', 'K8s'])
+    assert capsys.readouterr()[0] == 'config\n---\naliases: [k8s, Kube Ctl]\n---\n# Kubernetes\n\n'
+
+  def test_unchanged_topics_keep_aliases(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('kubernetes.md').write('---\naliases: k8s\n---\n')
+    quick.build_topic_index()
+    monkeypatch.setattr(quick, 'front_matter_aliases', lambda text: [])
+    cache_dir.join('new.md').write('')
+    os.utime(str(cache_dir), (1, 1))
+    quick.build_topic_index()
+    assert quick.resolve_topic('k8s') == 'kubernetes'
+
+class TestParallelUpdate:
+
+  # use_clones: quick and topics checkouts of two bare repos whose fetches
+  # take `latency` seconds, each with a new commit to pull
+  def use_clones(self, monkeypatch, tmpdir, latency):
+    clones = []
+    for name in ('quick', 'topics'):
+      origin, work = make_origin(tmpdir, name, {'git.md': '# Git\n'})
+      clone = tmpdir.join(name)
+      run_git(tmpdir, 'clone', '-q', str(origin), str(clone))
+      run_git(clone, 'config', 'remote.origin.uploadpack', 'sleep %s; git-upload-pack' % latency)
+      push_topics(work, {'ruby.md': 'gem install\n'})
+      clones.append(clone)
+
+    quick_dir, cache_dir = clones
+    monkeypatch.setattr(quick, 'QUICK_DIR', str(quick_dir))
+    use_cache_path(monkeypatch, cache_dir)
+    return quick_dir, cache_dir
+
+  def test_pulls_run_concurrently(self, monkeypatch, tmpdir, capsys):
+    import time
+    quick_dir, cache_dir = self.use_clones(monkeypatch, tmpdir, 1)
+    start = time.time()
+    quick.command_update(prerender=False)
+    assert time.time() - start < 1.8
+    assert quick_dir.join('ruby.md').check() and cache_dir.join('ruby.md').check()
+    assert quick.cache_list(None) == ['git', 'ruby']
+    lines = capsys.readouterr()[0].split('\n')
+    assert sorted(lines[:2]) == ['Updating quick... OK', 'Updating topics... OK']
+    assert lines[2] == 'Indexing topics... OK'
+
+  def test_errors_are_per_task(self, monkeypatch, tmpdir, capsys):
+    quick_dir, cache_dir = self.use_clones(monkeypatch, tmpdir, 0)
+    run_git(quick_dir, 'remote', 'set-url', 'origin', str(tmpdir.join('missing.git')))
+    quick.command_update(prerender=False)
+    assert quick.cache_list(None) == ['git', 'ruby']
+    out = capsys.readouterr()[0]
+    assert 'Updating quick... ERROR (' in out and 'Updating topics... OK\n' in out
+
+class TestGitRunner:
+
+  def test_timeout(self):
+    import time
+    start = time.time()
+    try:
+      quick.call(['sleep', '5'], timeout=0.2)
+      assert False
+    except BaseException as e:
+      assert 'timed out' in str(e)
+    assert time.time() - start < 2
+    assert quick.call(['echo', 'hi'], timeout=5)[1] == 'hi\n'
+
+  def test_call_lines(self):
+    assert list(quick.call_lines(['printf', 'a\\nb\\nc'])) == ['a', 'b', 'c']
+    assert list(quick.call_lines(['printf', 'a\\0b\\0'], sep='\0')) == ['a', 'b']
+    lines = quick.call_lines(['yes'])
+    assert next(lines) == 'y'
+    lines.close()  # Stops `yes`
+    try:
+      list(quick.call_lines(['ls', '/nonexistent-quick-dir']))
+      assert False
+    except BaseException as e:
+      assert 'nonexistent-quick-dir' in str(e)
+
+  def test_git_in_threads(self, tmpdir):
+    directories = []
+    for i in range(6):
+      directory = tmpdir.mkdir('repo%d' % i)
+      run_git(directory, 'init', '-q')
+      directory.join('topic%d.md' % i).write('x')
+      commit_all(directory)
+      directories.append(str(directory))
+    cwd = os.getcwd()
+    results = quick.run_parallel([lambda d=d: quick.git_tree_entries(d) for d in directories], jobs=3)
+    assert os.getcwd() == cwd
+    assert [entries[0][0] for entries, error in results] == ['topic%d' % i for i in range(6)]
+
+  def test_pool_is_bounded(self):
+    import threading, time
+    running = [0, 0]
+    lock = threading.Lock()
+    def job(i):
+      with lock:
+        running[0] += 1
+        running[1] = max(running)
+      time.sleep(0.05)
+      with lock:
+        running[0] -= 1
+      if i == 3:
+        raise ValueError('job 3')
+      return i
+    results = quick.run_parallel([lambda i=i: job(i) for i in range(8)], jobs=2)
+    assert running[1] == 2
+    assert [result for result, error in results] == [0, 1, 2, None, 4, 5, 6, 7]
+    assert str(results[3][1]) == 'job 3'
+
+class TestSources:
+
+  def use_sources(self, monkeypatch, tmpdir):
+    cache_dir = use_cache_dir(monkeypatch, tmpdir)
+    cache_dir.join('git.md').write('# Git\ngit push\n')
+    cache_dir.join('deploy.md').write('public deploy\n')
+    runbooks = tmpdir.mkdir('runbooks')
+    runbooks.join('deploy.md').write('private deploy\nrollback\n')
+    runbooks.join('ops:db.md').write('restore the database\n')
+    monkeypatch.setattr(quick, 'QUICK_SOURCES', [str(runbooks), str(tmpdir.join('missing'))])
+    return cache_dir, runbooks
+
+  def test_merged_index(self, monkeypatch, tmpdir, capsys):
+    cache_dir, runbooks = self.use_sources(monkeypatch, tmpdir)
+    for store in ('files', 'pack', 'sqlite'):
+      monkeypatch.setattr(quick, 'QUICK_STORE', store)
+      assert quick.cache_list(None) == ['deploy', 'git', 'ops:db']
+      assert quick.topic_store().data('deploy')[:] == 'private deploy\nrollback\n'
+      assert quick.topic_store().data('git')[:] == '# Git\ngit push\n'
+      assert [result[0] for result in quick.search_topics('rollback database')] == ['deploy', 'ops:db']
+      assert quick.main(['--nocolor', 'Ops-DB']) == quick.Exit.SUCCESS
+      assert capsys.readouterr()[0] == 'restore the database\n\n'
+    index = quick.load_topic_index()
+    assert index.source('deploy') == str(runbooks) and index.source('git') == str(cache_dir)
+
+  def test_source_changes(self, monkeypatch, tmpdir):
+    cache_dir, runbooks = self.use_sources(monkeypatch, tmpdir)
+    assert quick.search_topics('oncall') == []
+    runbooks.join('oncall.md').write('oncall rota\n')
+    os.utime(str(runbooks), (1, 1))
+    assert quick.load_topic_index() is None
+    assert 'oncall' in quick.cache_list(None)
+    assert [result[0] for result in quick.search_topics('oncall')] == ['oncall']
+
+  def test_edit_in_place(self, monkeypatch, tmpdir, capsys):
+    cache_dir, runbooks = self.use_sources(monkeypatch, tmpdir)
+    monkeypatch.setattr(quick, 'SOURCES_CHECK_INTERVAL', 0)
+    for store in ('files', 'pack', 'sqlite'):
+      monkeypatch.setattr(quick, 'QUICK_STORE', store)
+      runbooks.join('deploy.md').write('private deploy\nrollback\n')
+      assert quick.search_topics('canary') == []
+      assert quick.topic_store().data('deploy')[:] == 'private deploy\nrollback\n'
+
+      mtime = os.stat(str(runbooks)).st_mtime
+      runbooks.join('deploy.md').write('canary deploy\n')
+      os.utime(str(runbooks), (mtime, mtime))  # Only the file changed
+      assert [result[0] for result in quick.search_topics('canary')] == ['deploy']
+      assert quick.main(['--nocolor', 'deploy']) == quick.Exit.SUCCESS
+      assert capsys.readouterr()[0] == 'canary deploy\n\n'
+
+  def test_view_stats_one_topic(self, monkeypatch, tmpdir, capsys):
+    cache_dir, runbooks = self.use_sources(monkeypatch, tmpdir)
+    for i in range(50):
+      runbooks.join('topic%d.md' % i).write('')
+    quick.build_topic_index()
+    stat = os.stat
+    stats = []
+    monkeypatch.setattr(os, 'stat', lambda path: stats.append(path) or stat(path))
+    for store in ('files', 'pack'):
+      monkeypatch.setattr(quick, 'QUICK_STORE', store)
+      del stats[:]
+      assert quick.main(['--nocolor', 'deploy']) == quick.Exit.SUCCESS
+      assert capsys.readouterr()[0] == 'private deploy\nrollback\n\n'
+      assert not [path for path in stats if 'topic' in os.path.basename(path)]
+
+  def test_update_git_sources(self, monkeypatch, tmpdir, capsys):
+    cache_dir, runbooks = self.use_sources(monkeypatch, tmpdir)
+    origin, work = make_origin(tmpdir, 'team', {'k8s.md': 'kubectl get pods\n'})
+    team = tmpdir.join('team')
+    run_git(tmpdir, 'clone', '-q', str(origin), str(team))
+    monkeypatch.setattr(quick, 'QUICK_SOURCES', quick.QUICK_SOURCES + [str(team)])
+    assert quick.cache_list(None) == ['deploy', 'git', 'k8s', 'ops:db']
+
+    push_topics(work, {'helm.md': 'helm install\n'})
+    quick.cache_update(quiet=False, prerender=False)
+    out = capsys.readouterr()[0]
+    assert 'Updating %s... OK\n' % team in out and 'Updating topics... ERROR' in out
+    assert quick.cache_list(None) == ['deploy', 'git', 'helm', 'k8s', 'ops:db']
+    assert [result[0] for result in quick.search_topics('helm')] == ['helm']
+
+class TestShallowClone:
+
+  # use_origin: a bare repo with some history, served over file:// so clones
+  # honor --depth and --filter
+  def use_origin(self, tmpdir):
+    origin, work = make_origin(tmpdir, 'wiki', {'git.md': 'git\n', 'docker.md': 'docker\n', 'ruby.md': 'ruby\n'})
+    run_git(origin, 'config', 'uploadpack.allowFilter', 'true')
+    for i in range(4):
+      push_topics(work, {'git.md': 'git %d\n' % i, 'docker.md': 'docker %d\n' % i, 'ruby.md': 'ruby %d\n' % i})
+    return 'file://' + str(origin), work
+
+  def test_sparse_update(self, monkeypatch, tmpdir):
+    url, work = self.use_origin(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    run_git(tmpdir, 'clone', '-q', '--depth=1', '--filter=blob:none', '--no-checkout', url, str(cache_dir))
+    run_git(cache_dir, 'sparse-checkout', 'set', '--no-cone', '/git*.md', '/docker*.md')
+    run_git(cache_dir, 'checkout', '-q')
+    use_cache_path(monkeypatch, cache_dir)
+    assert quick.is_shallow(str(cache_dir))
+    assert quick.cache_list(None) == ['docker', 'git']
+
+    push_topics(work, {'git.md': 'git rebase\n', 'ruby.md': None, 'gitk.md': 'gitk --all\n'})
+    quick.cache_update(prerender=False)
+
+    assert quick.git_head(str(cache_dir)) == quick.git_head(str(work))
+    assert quick.call(['git', '-C', str(cache_dir), 'rev-list', '--count', 'HEAD'])[1].strip() == '1'
+    assert quick.cache_list(None) == ['docker', 'git', 'gitk']
+    assert [result[0] for result in quick.search_topics('rebase')] == ['git']
+
+  def test_reset_to_rewritten_history(self, monkeypatch, tmpdir):
+    url, work = self.use_origin(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    run_git(tmpdir, 'clone', '-q', url, str(cache_dir))
+    use_cache_path(monkeypatch, cache_dir)
+    run_git(work, 'commit', '-q', '--amend', '-m', 'rewritten')
+    run_git(work, 'push', '-q', '-f', 'origin', 'HEAD:master')
+    quick.cache_update(prerender=False)
+    assert quick.git_head(str(cache_dir)) == quick.git_head(str(work))
+
+class TestAutoUpdate:
+
+  def use_stale_clone(self, monkeypatch, tmpdir, latency):
+    origin, work = make_origin(tmpdir, 'wiki', {'git.md': 'old\n'})
+    cache_dir = tmpdir.join('cache')
+    run_git(tmpdir, 'clone', '-q', str(origin), str(cache_dir))
+    run_git(cache_dir, 'config', 'remote.origin.uploadpack', 'sleep %s; git-upload-pack' % latency)
+    push_topics(work, {'git.md': 'new\n'})
+    monkeypatch.setattr(quick, 'QUICK_AUTO_UPDATE', 24)
+    return use_cache_path(monkeypatch, cache_dir)
+
+  def test_view_updates_in_background(self, monkeypatch, tmpdir, capsys):
+    import time
+    cache_dir = self.use_stale_clone(monkeypatch, tmpdir, 1)
+    assert quick.cache_stale()
+    start = time.time()
+    quick.main(['--nocolor', 'git'])
+    assert time.time() - start < 0.8
+    assert capsys.readouterr()[0] == 'old\n\n'
+    assert not quick.cache_stale()  # Started
+
+    for i in range(100):
+      if os.path.exists(quick.updated_path()):
+        break
+      time.sleep(0.1)
+    assert not quick.cache_stale()
+    quick.main(['--nocolor', 'git'])
+    assert capsys.readouterr()[0] == 'new\n\n'
+
+  def test_env_hours(self, monkeypatch):
+    for value, hours in (('abc', 24), ('', 24), ('-3', 0), ('0', 0), ('1.5', 1.5)):
+      monkeypatch.setenv('QUICK_AUTO_UPDATE', value)
+      assert quick.env_hours('QUICK_AUTO_UPDATE', 24) == hours
+
+  def test_command_view_does_not_fork(self, monkeypatch, tmpdir, capsys):
+    cache_dir = self.use_stale_clone(monkeypatch, tmpdir, 0)
+    monkeypatch.setattr(os, 'fork', lambda: 1 / 0)
+    assert quick.command_view('git', color_mode=quick.ColorMode.OFF) == quick.Exit.SUCCESS
+    assert capsys.readouterr()[0] == 'old\n\n'
+
+  def test_update_lock(self, monkeypatch, tmpdir):
+    import fcntl, time
+    cache_dir = self.use_stale_clone(monkeypatch, tmpdir, 0)
+    quick._touch(quick.update_lock_path())
+    with open(quick.update_lock_path()) as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      quick.background_update()
+    assert not os.path.exists(quick.updated_path())
+    assert cache_dir.join('git.md').read() == 'old\n'
+
+    os.utime(quick.update_lock_path(), (1, 1))  # An old, failed attempt
+    assert quick.cache_stale()
+    quick.background_update()
+    assert cache_dir.join('git.md').read() == 'new\n'
+    assert not quick.cache_stale()
+
+  def test_foreground_update_waits(self, monkeypatch, tmpdir):
+    import fcntl, threading, time
+    cache_dir = self.use_stale_clone(monkeypatch, tmpdir, 0)
+    quick._touch(quick.update_lock_path())
+    with open(quick.update_lock_path()) as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)  # A background update running
+      update = threading.Thread(target=quick.cache_update, kwargs={'prerender': False})
+      update.start()
+      time.sleep(0.5)
+      assert cache_dir.join('git.md').read() == 'old\n'
+    update.join(10)
+    assert cache_dir.join('git.md').read() == 'new\n'